@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import statistics
+import importlib.util
+
+import requests
+
+API_KEY = os.environ.get("DEEPSEEK_API_KEY", "")
+WEEKS = 20
+
+# Load versions/CAS_AUTOFILL.py as a module (the file name is not importable directly).
+_here = os.path.dirname(os.path.abspath(__file__))
+_spec = importlib.util.spec_from_file_location("cas_autofill", os.path.join(_here, "versions", "CAS_AUTOFILL.py"))
+cas = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(cas)
+
+# A tiny request so the timing is dominated by connection setup, not generation.
+messages = [{"role": "user", "content": "Reply with the single word OK."}]
+
+
+payload = {"model": "deepseek-chat", "messages": messages, "temperature": 0, "max_tokens": 5}
+
+
+def bare_call():
+    headers = {"Authorization": f"Bearer {API_KEY}", "Content-Type": "application/json"}
+    r = requests.post(cas.DEEPSEEK_CHAT_ENDPOINT, headers=headers, json=payload, timeout=90)
+    r.raise_for_status()
+    return r.json()
+
+
+def pooled_call():
+    # One raw HTTP attempt on the pooled session: deepseek_chat would add the response cache (every call
+    # after the first is a SQLite hit), the rate limiter and retries, none of which is being measured here.
+    return cas._deepseek_post(API_KEY, payload, timeout=90)
+
+
+def run(label, fn):
+    times = []
+    for week in range(1, WEEKS + 1):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+        print(f"{label:>7} week {week:2d}: {times[-1] * 1000:7.1f} ms")
+    return times
+
+
+if __name__ == "__main__":
+    if not API_KEY:
+        sys.exit("Set DEEPSEEK_API_KEY first.")
+
+    bare = run("bare", bare_call)
+    pooled = run("pooled", pooled_call)
+
+    print()
+    for label, times in [("bare", bare), ("pooled", pooled)]:
+        print(
+            f"{label:>7}: mean {statistics.mean(times) * 1000:7.1f} ms, "
+            f"median {statistics.median(times) * 1000:7.1f} ms, total {sum(times):6.2f} s"
+        )
+    saved = statistics.mean(bare) - statistics.mean(pooled)
+    print(f"Per-call saving: {saved * 1000:.1f} ms; over {WEEKS} weeks: {saved * WEEKS:.2f} s")
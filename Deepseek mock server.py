@@ -0,0 +1,240 @@
+"""Local stand-in for the DeepSeek chat API, for offline runs, tests and benchmarks.
+
+    python "Deepseek mock server.py" --port 8765 --latency 0.3 --rate-429 0.05
+    DEEPSEEK_BASE_URL=http://127.0.0.1:8765 python versions/CAS_AUTOFILL.py
+
+Answers /v1/chat/completions (plain and streamed) with canned text chosen by the system prompt of each
+CAS_AUTOFILL generator, sized to pass its local word checks. max_tokens is honoured (finish_reason
+"length"), usage includes prompt-cache hit/miss tokens, and 429 / 500 / hanging requests can be injected.
+"""
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SENTENCES = [
+    "I opened the session by recapping the key question from last week and asking two members to summarise it.",
+    "We compared a primary source from 1919 with a modern textbook account and listed three differences.",
+    "I prepared a short handout on the causes of the Great Depression and tested it with a partner first.",
+    "During the discussion I noticed that quieter members spoke more once we switched to small groups.",
+    "Our advisor suggested that I cut my introduction in half, so I rewrote it around one clear example.",
+    "I kept a timer on the table so each speaker had exactly three minutes before the rebuttal round.",
+    "Two members disagreed about the role of propaganda, and I asked each of them to cite specific evidence.",
+    "I changed the seating plan so that new members sat next to experienced debaters for the practice motion.",
+    "We used a shared document to collect questions, which made it easier to follow up the next day.",
+    "I learned that the Treaty of Versailles was debated for months before it was signed in June 1919.",
+    "After the session I asked for written feedback and received five concrete suggestions for next week.",
+    "I realised that my explanations were clearer when I linked each point to a date and a named person.",
+]
+CLOSING = "Next time I want to plan the timing more carefully and give every member a clear role."
+TOPICS = ["Source Analysis", "Rebuttal Practice", "Research Skills", "Public Speaking", "Case Building",
+          "Historical Debate", "Peer Feedback", "Planning Meeting", "Evidence Review", "Mock Trial"]
+FORMATS = ["Workshop", "Clinic", "Session", "Round Table", "Lab", "Challenge"]
+
+
+def words(n: int, closing: bool = True) -> str:
+    """English prose of roughly n words (never fewer), ending on a full sentence."""
+    out, count = [], 0
+    for s in itertools.cycle(random.sample(SENTENCES, len(SENTENCES))):
+        if count >= n - (len(CLOSING.split()) if closing else 0):
+            break
+        out.append(s)
+        count += len(s.split())
+    if closing:
+        out.append(CLOSING)
+    return " ".join(out)
+
+
+def paragraphs(n: int, count: int = 5) -> str:
+    per = n // count + 1
+    return "\n\n".join(words(per, closing=(i == count - 1)) for i in range(count))
+
+
+def summary_sentence() -> str:
+    return ("I learned how careful source analysis and clear teamwork turned a rough history talk "
+            "into a confident presentation.")
+
+
+def unique_theme(k: int) -> str:
+    return f"{TOPICS[k % len(TOPICS)]} {FORMATS[(k // len(TOPICS)) % len(FORMATS)]} for Club Members"
+
+
+_theme_counter = itertools.count()
+
+
+def canned_answer(messages: list) -> str:
+    system = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+    first_user = next((m["content"] for m in messages if m["role"] == "user"), "")
+    last = messages[-1]["content"]
+
+    if "You were cut off" in last:
+        return words(40)
+    more = re.search(r"Write about (\d+) more words", last)
+    if more:
+        return words(int(more.group(1)) + 10, closing=False)
+    if system.startswith("Plan a term"):
+        dates = re.search(r"Dates \((\d+)\)", first_user)
+        n = int(dates.group(1)) if dates else 1
+        start = next(_theme_counter) * 100
+        return json.dumps({"themes": [unique_theme(start + i) for i in range(n)]})
+    if "Activity theme and Activity Description" in system:
+        return json.dumps({"theme": unique_theme(next(_theme_counter)), "description": words(100)})
+    if system.startswith("Write the Activity Description"):
+        return words(100)
+    if "summary, then content" in system:
+        return json.dumps({"summary": summary_sentence(), "content": paragraphs(650)})
+    if "one natural English sentence" in system:
+        return summary_sentence()
+    if "long-form IB CAS reflections" in system:
+        return paragraphs(650)
+    if "Activity Records" in system:
+        least = re.search(r"must be >= (\d+) words", first_user)
+        return words((int(least.group(1)) if least else 120) + 25)
+    return "OK"
+
+
+def count_tokens(text: str) -> int:
+    return max(1, round(len(text.split()) * 1.3 + text.count("\n")))
+
+
+class MockState:
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.seen_prefixes = set()
+        self.requests = 0
+
+    def prompt_usage(self, messages: list) -> dict:
+        """DeepSeek-style context caching: a system prompt seen before counts as cache hit tokens."""
+        prompt = sum(count_tokens(m.get("content", "")) + 4 for m in messages)
+        system = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+        hit = 0
+        with self.lock:
+            if system in self.seen_prefixes:
+                hit = min(prompt, count_tokens(system) // 64 * 64)
+            self.seen_prefixes.add(system)
+        return {"prompt_tokens": prompt, "prompt_cache_hit_tokens": hit, "prompt_cache_miss_tokens": prompt - hit}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # headers and body go out in separate writes; keep-alive must not stall
+    state = None
+
+    def log_message(self, fmt, *args):
+        if not self.state.args.quiet:
+            super().log_message(fmt, *args)
+
+    def _send_json(self, code: int, obj: dict, headers=None):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(code)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        args = self.state.args
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            return self._send_json(400, {"error": {"message": "invalid JSON body"}})
+        if not self.path.rstrip("/").endswith("chat/completions"):
+            return self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+        with self.state.lock:
+            self.state.requests += 1
+
+        roll = random.random()
+        if roll < args.rate_429:
+            return self._send_json(429, {"error": {"message": "rate limited"}}, {"Retry-After": str(args.retry_after)})
+        if roll < args.rate_429 + args.rate_500:
+            return self._send_json(500, {"error": {"message": "injected server error"}})
+        if roll < args.rate_429 + args.rate_500 + args.rate_hang:
+            time.sleep(args.hang_seconds)
+            return self._send_json(504, {"error": {"message": "injected timeout"}})
+
+        messages = body.get("messages") or []
+        text = canned_answer(messages)
+        finish_reason = "stop"
+        max_tokens = int(body.get("max_tokens") or 4096)
+        if count_tokens(text) > max_tokens:
+            kept = text.split(" ")[: max(1, int(max_tokens / 1.3))]
+            text, finish_reason = " ".join(kept), "length"
+        usage = self.state.prompt_usage(messages)
+        usage["completion_tokens"] = count_tokens(text)
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        time.sleep(max(0.0, args.latency + random.uniform(-args.jitter, args.jitter)))
+        per_token = 1.0 / args.tokens_per_second if args.tokens_per_second > 0 else 0.0
+        model = body.get("model", "deepseek-chat")
+
+        if not body.get("stream"):
+            time.sleep(usage["completion_tokens"] * per_token)
+            return self._send_json(200, {
+                "id": f"mock-{self.state.requests}",
+                "object": "chat.completion",
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": finish_reason}],
+                "usage": usage,
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            pieces = re.findall(r"\S+\s*", text)
+            for i in range(0, len(pieces), 4):
+                delta = "".join(pieces[i:i + 4])
+                chunk = {"choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]}
+                self._chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                time.sleep(count_tokens(delta) * per_token)
+            final = {"choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]}
+            self._chunk(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+            if (body.get("stream_options") or {}).get("include_usage"):
+                self._chunk(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+            self._chunk(b"data: [DONE]\n\n")
+            self._chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client stopped reading early (stop_when)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local DeepSeek-compatible mock server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds before the first byte")
+    parser.add_argument("--jitter", type=float, default=0.1, help="+/- random seconds added to latency")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="generation speed; 0 = instant")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429")
+    parser.add_argument("--rate-500", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--rate-hang", type=float, default=0.0, help="fraction of requests that hang")
+    parser.add_argument("--hang-seconds", type=float, default=120.0, help="how long a hanging request stalls")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    Handler.state = MockState(args)
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f"DeepSeek mock listening on http://{args.host}:{args.port} (set DEEPSEEK_BASE_URL to this)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
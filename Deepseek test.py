@@ -1,7 +1,9 @@
+import os
 import requests
 
-API_KEY = ""
-url = "https://api.deepseek.com/v1/chat/completions"
+API_KEY = os.environ.get("DEEPSEEK_API_KEY", "")
+BASE_URL = os.environ.get("DEEPSEEK_BASE_URL", "https://api.deepseek.com").rstrip("/")
+url = f"{BASE_URL}/v1/chat/completions"
 headers = {"Authorization": f"Bearer {API_KEY}", "Content-Type": "application/json"}
 
 messages = [{"role": "system", "content": "Reply in Chinese, concise."}]
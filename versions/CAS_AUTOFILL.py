@@ -1,20 +1,86 @@
 ﻿import threading
 import queue
+import asyncio
+import concurrent.futures
+import functools
+import weakref
 import re
 import time
 import html
 import json
 import calendar
+import contextlib
+import contextvars
+import os
+import sqlite3
+import hashlib
+import hmac
+import base64
+import secrets
+import random
+import email.utils
 from datetime import date as dt_date, timedelta
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import tkinter as tk
 from tkinter import ttk, messagebox
 
 from playwright.sync_api import sync_playwright, TimeoutError as PWTimeoutError
 
 URL = "http://101.227.232.33:8001/"
-DEEPSEEK_BASE_URL = "https://api.deepseek.com"
+# Point at a local stand-in ("Deepseek mock server.py") with DEEPSEEK_BASE_URL=http://127.0.0.1:8765
+DEEPSEEK_BASE_URL = os.environ.get("DEEPSEEK_BASE_URL", "https://api.deepseek.com").rstrip("/")
 DEEPSEEK_CHAT_ENDPOINT = f"{DEEPSEEK_BASE_URL}/v1/chat/completions"
+DEEPSEEK_POOL_SIZE = 8
+DEEPSEEK_ADAPTER_RETRIES = 2
+DEEPSEEK_MAX_CONCURRENCY = 4
+DEEPSEEK_PIPELINE_PREFETCH = 4
+DEEPSEEK_TIMEOUT = 90
+DEEPSEEK_CALL_DEADLINE = 300
+DEEPSEEK_MAX_ATTEMPTS = 5
+DEEPSEEK_MAX_TIMEOUTS = 2
+DEEPSEEK_MAX_CONTINUATIONS = 2
+DEEPSEEK_CANDIDATES = 3
+DEEPSEEK_BACKOFF_BASE = 2.0
+DEEPSEEK_BACKOFF_MAX = 30.0
+DEEPSEEK_RETRY_STATUSES = {429, 500, 502, 503, 504}
+DEEPSEEK_BREAKER_THRESHOLD = 3
+DEEPSEEK_BREAKER_COOLDOWN = 30
+DEEPSEEK_BREAKER_PROBE_TIMEOUT = 20
+DEEPSEEK_BREAKER_MAX_PAUSE = 600
+DEEPSEEK_RATE_LIMIT_RPM = 120
+DEEPSEEK_RATE_LIMIT_TPM = 300000
+DEEPSEEK_CACHE_TTL = 14 * 24 * 3600
+DEEPSEEK_CACHE_MAX_ROWS = 5000
+DEEPSEEK_TOKENS_PER_WORD = 1.4
+DEEPSEEK_BUDGET_MARGIN = 1.3
+APP_DATA_DIR = os.path.join(os.path.expanduser("~"), ".cas_autofill")
+# Per-task overrides (task = generator name, or "default"); config.json "routes" entries are merged on top.
+DEEPSEEK_ROUTES = {
+    "reflection_summary": {"timeout": 30},
+    "weekly_theme_desc": {"timeout": 45},
+    "weekly_plan": {"timeout": 45},
+}
+APP_CONFIG_PATH = os.path.join(APP_DATA_DIR, "config.json")
+# Browser speed profiles: "watch" is the original pace, "turbo" runs without a window and skips heavy assets.
+SPEED_PROFILES = {
+    "watch": {"headless": False, "slow_mo": 60, "block_resources": False, "static_cache": False},
+    "fast": {"headless": False, "slow_mo": 0, "block_resources": False, "static_cache": False},
+    "turbo": {"headless": True, "slow_mo": 0, "block_resources": True, "static_cache": True},
+}
+DEFAULT_SPEED_PROFILE = "watch"
+# Network filter for the WFLA pages (turbo only: any page.route turns off Chromium's HTTP cache, which
+# would make fast re-download everything it does not block). Allow patterns win over deny; config.json
+# "network" {"allow": [...], "deny": [...]} adds URL regexes. Only JS/CSS answered 200 to a GET goes on disk.
+NETWORK_DENY_TYPES = {"image", "media", "font"}
+NETWORK_DENY_URLS = [
+    r"google-analytics\.com", r"googletagmanager\.com", r"hm\.baidu\.com", r"\.cnzz\.com",
+    r"\.umeng\.com", r"/(analytics|gtag|stat|tongji)(\.min)?\.js",
+]
+NETWORK_ALLOW_URLS = [r"(?i)captcha|verifycode"]
+STATIC_CACHE_TYPES = {"script", "stylesheet"}
+STATIC_CACHE_TTL = 7 * 24 * 3600
 CONVERSATION_CLUB = "谈话记录(Conversation)"
 UI_COLORS = {
     "bg": "#F5F7FB",
@@ -61,22 +127,22 @@ def pick_context(page, iframe_css: str):
     return page
 
 
-def _find_iframe_src_contains(page, must_contain: list[str], timeout_ms: int = 15000):
-    """Return the first iframe src that contains all substrings (best-effort)."""
-    end = time.time() + timeout_ms / 1000
-    while time.time() < end:
-        for h in page.locator("iframe").element_handles():
-            src = h.get_attribute("src") or ""
-            if src and all(s in src for s in must_contain):
-                return src
-        time.sleep(0.12)
-    return None
+def _find_frame_url_contains(page, must_contain: list[str], timeout_ms: int = 15000, exclude: str = ""):
+    """Return the first Frame whose URL contains all substrings (and not `exclude`), or None on timeout.
 
+    Frames already loaded are checked from Playwright's local frame tree; otherwise this waits on
+    "framenavigated" events, so it resolves as soon as the matching iframe commits its navigation."""
+    def matches(frame):
+        url = frame.url
+        return all(s in url for s in must_contain) and not (exclude and exclude in url)
 
-def _frame_locator_by_src(page, src: str):
-    # Escape for CSS attribute selector
-    esc = src.replace("\\", "\\\\").replace('"', '\\"')
-    return page.frame_locator(f'iframe[src="{esc}"]')
+    for frame in page.frames:
+        if matches(frame):
+            return frame
+    try:
+        return page.wait_for_event("framenavigated", predicate=matches, timeout=timeout_ms)
+    except PWTimeoutError:
+        return None
 
 
 def int_from_text(t: str) -> int:
@@ -119,136 +185,1315 @@ def select_date_layui(scope, target_year: int, target_month: int, target_day: in
     cal.locator(f"td[lay-ymd='{target_year}-{target_month}-{target_day}']").click()
 
 
-def deepseek_chat(api_key: str, model: str, messages: list, temperature: float = 0.5, max_tokens: int = 600) -> dict:
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-    payload = {
-        "model": model,
-        "messages": messages,
-        "temperature": temperature,
-        "max_tokens": max_tokens,
+def word_count(s: str) -> int:
+    if re.search(r"[A-Za-z]", s):
+        return len(re.findall(r"[A-Za-z0-9]+(?:'[A-Za-z0-9]+)?", s))
+    return len(re.findall(r"\S", s))
+
+
+def read_app_config() -> dict:
+    """~/.cas_autofill/config.json as a dict; missing or unreadable means {}."""
+    try:
+        with open(APP_CONFIG_PATH, encoding="utf-8") as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return config if isinstance(config, dict) else {}
+
+
+def update_app_config(**values):
+    """Set top-level keys in config.json, keeping everything else (e.g. DeepSeek routes)."""
+    config = read_app_config()
+    config.update(values)
+    os.makedirs(APP_DATA_DIR, exist_ok=True)
+    with open(APP_CONFIG_PATH, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+
+
+class RunCancelled(RuntimeError):
+    pass
+
+
+class StepTimer:
+    """Wall time of named browser steps for one run, summarised per speed profile.
+
+    The timer is also the run's stop switch: after cancel() (called from the GUI thread) the next
+    step() raises RunCancelled, so the run stops between browser steps, and the on_cancel hooks
+    (e.g. GenerationPipeline.close) run at once."""
+
+    def __init__(self, profile: str):
+        self.profile = profile
+        self.steps = {}
+        self.cancelled = threading.Event()
+        self._cancel_hooks = []
+
+    def cancel(self):
+        self.cancelled.set()
+        for fn in self._cancel_hooks:
+            fn()
+
+    def on_cancel(self, fn):
+        self._cancel_hooks.append(fn)
+        if self.cancelled.is_set():
+            fn()
+
+    @contextlib.contextmanager
+    def step(self, name: str):
+        if self.cancelled.is_set():
+            raise RunCancelled("run stopped by user.")
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.setdefault(name, []).append(time.perf_counter() - start)
+
+    def summary(self) -> str:
+        parts = []
+        for name, times in self.steps.items():
+            if len(times) == 1:
+                parts.append(f"{name} {times[0]:.2f}s")
+            else:
+                parts.append(f"{name} {sum(times) / len(times):.2f}s avg x{len(times)}")
+        return f"[Timing][{self.profile}] " + (", ".join(parts) or "no steps")
+
+
+# -----------------------------
+# DeepSeek client
+# -----------------------------
+
+_deepseek_session = None
+_deepseek_session_size = 0
+_deepseek_session_lock = threading.Lock()
+
+
+def get_deepseek_session(pool_size: int = 0) -> requests.Session:
+    """Shared keep-alive session for all DeepSeek calls (thread-safe; pass pool_size to resize the pool)."""
+    global _deepseek_session, _deepseek_session_size
+    size = pool_size or _deepseek_session_size or DEEPSEEK_POOL_SIZE
+    with _deepseek_session_lock:
+        if _deepseek_session is None or size != _deepseek_session_size:
+            session = requests.Session()
+            # Only connection-level failures are retried here: the request never reached the server.
+            retry = Retry(total=DEEPSEEK_ADAPTER_RETRIES, connect=DEEPSEEK_ADAPTER_RETRIES, read=0, status=0,
+                          backoff_factor=0.3)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size, pool_block=True, max_retries=retry)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"Connection": "keep-alive", "Content-Type": "application/json"})
+            if _deepseek_session is not None:
+                _deepseek_session.close()
+            _deepseek_session, _deepseek_session_size = session, size
+        return _deepseek_session
+
+
+def _read_chat_stream(r, on_delta=None, stop_when=None) -> dict:
+    """Consume a server-sent-event chat stream and return it in the non-streaming response shape."""
+    parts = []
+    finish_reason = None
+    usage = None
+    stopped_early = False
+    for raw_line in r.iter_lines():
+        line = raw_line.decode("utf-8", errors="replace").strip() if raw_line else ""
+        if not line.startswith("data:"):
+            continue  # blank separators and ": keep-alive" comments
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        chunk = json.loads(data)
+        usage = chunk.get("usage") or usage
+        for choice in chunk.get("choices") or []:
+            delta = (choice.get("delta") or {}).get("content") or ""
+            if delta:
+                parts.append(delta)
+            finish_reason = choice.get("finish_reason") or finish_reason
+        if not parts:
+            continue
+        text = "".join(parts)
+        if on_delta:
+            on_delta(text)
+        if stop_when and finish_reason is None and stop_when(text):
+            stopped_early = True
+            break
+    r.close()
+    return {
+        "choices": [{"message": {"role": "assistant", "content": "".join(parts)}, "finish_reason": finish_reason or "stop"}],
+        "usage": usage,
+        "stopped_early": stopped_early,
     }
-    r = requests.post(DEEPSEEK_CHAT_ENDPOINT, headers=headers, json=payload, timeout=90)
+
+
+class DeepSeekAPIError(RuntimeError):
+    def __init__(self, status_code: int, body, retry_after=None):
+        super().__init__(f"DeepSeek API error HTTP {status_code}: {body}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+_deepseek_logger = None
+
+
+def set_deepseek_logger(fn):
+    """Route client-level notices (retries, backoff) to fn(msg), e.g. the GUI log."""
+    global _deepseek_logger
+    _deepseek_logger = fn
+
+
+def _deepseek_log(msg: str):
+    if _deepseek_logger:
+        _deepseek_logger(msg)
+
+
+def estimate_tokens(messages: list) -> int:
+    """Rough prompt size: ~4 ASCII chars per token, CJK closer to one token per char."""
+    total = 0
+    for m in messages:
+        text = str(m.get("content", ""))
+        ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+        total += ascii_chars // 4 + int((len(text) - ascii_chars) * 0.6) + 4
+    return total
+
+
+class TokenBucket:
+    """Refills continuously at per_minute/60 units per second up to per_minute."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.stamp = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_for(self, amount: float) -> float:
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+
+class DeepSeekRateLimiter:
+    """Process-wide requests/min + tokens/min limiter shared by every deepseek_chat attempt."""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.blocked_until = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, tokens: int, timeout: float) -> float:
+        """Block until one request and `tokens` tokens are available; return seconds waited."""
+        tokens = min(tokens, self.tokens.capacity)
+        start = time.monotonic()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self.requests.refill(now)
+                self.tokens.refill(now)
+                wait = max(self.blocked_until - now, self.requests.wait_for(1), self.tokens.wait_for(tokens))
+                if wait <= 0:
+                    self.requests.level -= 1
+                    self.tokens.level -= tokens
+                    return now - start
+                if now + wait - start > timeout:
+                    raise RuntimeError(f"DeepSeek rate limiter would wait {wait:.0f}s, past the call deadline.")
+                self._cond.wait(wait)
+
+    def settle(self, estimated: int, actual: int):
+        """Give back the part of the estimate (prompt + max_tokens) the call did not use."""
+        if actual and actual < estimated:
+            with self._cond:
+                self.tokens.level = min(self.tokens.capacity, self.tokens.level + (estimated - actual))
+                self._cond.notify_all()
+
+    def pause(self, seconds: float):
+        """After a 429, hold every caller instead of letting them burst into more 429s."""
+        with self._cond:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+DEEPSEEK_RATE_LIMITER = DeepSeekRateLimiter(DEEPSEEK_RATE_LIMIT_RPM, DEEPSEEK_RATE_LIMIT_TPM)
+
+
+class DeepSeekCircuitOpen(RuntimeError):
+    def __init__(self, retry_in: float):
+        super().__init__(f"DeepSeek is unavailable (circuit open); next probe in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+class DeepSeekCircuitBreaker:
+    """Fail fast while DeepSeek is down instead of waiting out a full timeout per call.
+
+    closed: calls go through. After `threshold` consecutive failures (timeouts, dropped connections,
+    5xx) it opens and every new attempt raises DeepSeekCircuitOpen at once. After `cooldown` seconds
+    it is half-open: one probe call is let through; success closes it, failure re-opens it.
+    on_change(state) is called on every transition (the GUI shows it in the footer)."""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.on_change = None
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _set(self, state: str):
+        if state == self.state:
+            return
+        self.state = state
+        if state == "open":
+            _deepseek_log(f"[DeepSeek] {self.failures} failures in a row; pausing calls for {self.cooldown:.0f}s")
+        elif state == "closed":
+            _deepseek_log("[DeepSeek] probe succeeded; calls resumed")
+        if self.on_change:
+            self.on_change(state)
+
+    def retry_in(self) -> float:
+        with self._lock:
+            if self.state == "closed":
+                return 0.0
+            return max(0.0, self._opened_at + self.cooldown - time.monotonic())
+
+    def before_call(self) -> bool:
+        """Raise DeepSeekCircuitOpen unless an attempt may go out; True means it is the half-open probe."""
+        with self._lock:
+            if self.state == "closed":
+                return False
+            wait = self._opened_at + self.cooldown - time.monotonic()
+            if self.state == "open" and wait <= 0:
+                self._set("half_open")
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            raise DeepSeekCircuitOpen(max(wait, 1.0))
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self._set("closed")
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == "half_open" or self.failures >= self.threshold:
+                self._opened_at = time.monotonic()
+                self._set("open")
+
+    def end_probe(self):
+        """Close out a probe attempt. A probe that ended without record_success/record_failure (an
+        unexpected exception: deadline, bad JSON, a failing callback) counts as a failure, so the
+        breaker re-opens instead of staying half-open with the probe slot taken forever."""
+        with self._lock:
+            unresolved = self._probing
+        if unresolved:
+            self.record_failure()
+
+
+DEEPSEEK_BREAKER = DeepSeekCircuitBreaker(DEEPSEEK_BREAKER_THRESHOLD, DEEPSEEK_BREAKER_COOLDOWN)
+
+
+class DeepSeekResponseCache:
+    """On-disk cache of successful chat responses, keyed by a hash of the request payload.
+
+    max_tokens is not part of the key: budgets move as DEEPSEEK_TOKEN_BUDGETS learns, and a changed budget
+    must not make a resumed run miss the answers it should replay. An answer that finished ("stop") is
+    served for any budget; a cut-off one ("length") only for the exact budget it was cut at.
+    Entries expire after `ttl` seconds and the table is trimmed to the newest `max_rows`.
+    With `bypass` set, lookups always miss but fresh responses are still stored."""
+
+    def __init__(self, path: str, ttl: float, max_rows: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.bypass = False
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(payload: dict, salt: str = "") -> str:
+        """salt tells apart deliberately repeated requests, e.g. parallel candidates of one prompt."""
+        stable = {k: v for k, v in payload.items() if k not in ("stream", "stream_options", "max_tokens")}
+        raw = json.dumps(stable, sort_keys=True, ensure_ascii=False) + salt
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _db(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, created REAL, response TEXT)"
+            )
+        return self._conn
+
+    def get(self, key: str, max_tokens: int):
+        with self._lock:
+            if self.bypass:
+                self.misses += 1
+                return None
+            try:
+                row = self._db().execute(
+                    "SELECT response FROM responses WHERE key = ? AND created >= ?", (key, time.time() - self.ttl)
+                ).fetchone()
+            except sqlite3.Error as e:
+                _deepseek_log(f"[DeepSeek] cache read failed: {e}")
+                row = None
+            entry = json.loads(row[0]) if row is not None else {}
+            response = entry.get("response")
+            if response is None or (
+                response["choices"][0].get("finish_reason") != "stop" and entry.get("max_tokens") != max_tokens
+            ):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return response
+
+    def put(self, key: str, response: dict, max_tokens: int):
+        with self._lock:
+            try:
+                db = self._db()
+                with db:
+                    db.execute(
+                        "INSERT OR REPLACE INTO responses (key, created, response) VALUES (?, ?, ?)",
+                        (key, time.time(), json.dumps({"max_tokens": max_tokens, "response": response},
+                                                      ensure_ascii=False)),
+                    )
+                    self._puts += 1
+                    if self._puts % 50 == 1:
+                        self._evict(db)
+            except sqlite3.Error as e:
+                _deepseek_log(f"[DeepSeek] cache write failed: {e}")
+
+    def _evict(self, db):
+        db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        db.execute(
+            "DELETE FROM responses WHERE key NOT IN "
+            "(SELECT key FROM responses ORDER BY created DESC LIMIT ?)",
+            (self.max_rows,),
+        )
+
+    def reset_counters(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+
+DEEPSEEK_CACHE = DeepSeekResponseCache(
+    os.path.join(APP_DATA_DIR, "deepseek_cache.sqlite3"), DEEPSEEK_CACHE_TTL, DEEPSEEK_CACHE_MAX_ROWS
+)
+
+
+class TokenBudgetCalibration:
+    """Observed completion tokens per output word, per generator, kept in a small JSON file.
+
+    max_tokens(generator, words) turns a word target into a budget: words x learned ratio x margin,
+    rounded up to a multiple of 32. The ratio is a moving average updated after every completed answer,
+    so budgets drift between (and within) runs; DEEPSEEK_CACHE therefore leaves max_tokens out of its key.
+    Until a generator has a few samples the DEEPSEEK_TOKENS_PER_WORD default is used."""
+
+    MIN_SAMPLES = 3
+    SMOOTHING = 0.2
+
+    def __init__(self, path: str, default_ratio: float = DEEPSEEK_TOKENS_PER_WORD, margin: float = DEEPSEEK_BUDGET_MARGIN):
+        self.path = path
+        self.default_ratio = default_ratio
+        self.margin = margin
+        self._data = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        if self._data is None:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self._data = json.load(f)
+            except (OSError, ValueError):
+                self._data = {}
+        return self._data
+
+    def observe(self, generator: str, completion_tokens: int, text: str):
+        words = word_count(text)
+        if not generator or completion_tokens <= 0 or words < 5:
+            return
+        ratio = completion_tokens / words
+        with self._lock:
+            entry = self._load().setdefault(generator, {"ratio": ratio, "samples": 0})
+            entry["ratio"] = round(entry["ratio"] + self.SMOOTHING * (ratio - entry["ratio"]), 4)
+            entry["samples"] += 1
+            self._dirty = True
+
+    def ratio(self, generator: str) -> float:
+        with self._lock:
+            entry = self._load().get(generator)
+        if not entry or entry["samples"] < self.MIN_SAMPLES:
+            return self.default_ratio
+        return entry["ratio"]
+
+    def max_tokens(self, generator: str, words: int, floor: int = 32, ceiling: int = 4096) -> int:
+        budget = words * self.ratio(generator) * self.margin + 16
+        return max(floor, min(ceiling, -(-int(budget) // 32) * 32))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {k: dict(v) for k, v in self._load().items()}
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self._data, f, indent=2)
+            self._dirty = False
+
+
+DEEPSEEK_TOKEN_BUDGETS = TokenBudgetCalibration(os.path.join(APP_DATA_DIR, "token_calibration.json"))
+
+
+class DeepSeekRouter:
+    """Task -> {model, temperature, max_tokens, timeout} routing table.
+
+    Built from DEEPSEEK_ROUTES plus the "routes" object of config.json, e.g.
+        {"routes": {"reflection_summary": {"model": "deepseek-chat", "timeout": 20},
+                    "reflection": {"temperature": 0.6}}}
+    A "default" route applies to every task; task entries win over it. Keys left out keep what the
+    generator asked for (including the adaptive max_tokens budget)."""
+
+    KEYS = {"model": str, "temperature": float, "max_tokens": int, "timeout": float}
+
+    def __init__(self, path: str, defaults: dict):
+        self.path = path
+        self.defaults = defaults
+        self.routes = {task: dict(route) for task, route in defaults.items()}
+
+    def load(self) -> dict:
+        """(Re)read config.json; a missing file means the built-in table, a broken one is logged and skipped."""
+        routes = {task: dict(route) for task, route in self.defaults.items()}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                configured = (json.load(f) or {}).get("routes") or {}
+        except FileNotFoundError:
+            configured = {}
+        except (OSError, ValueError, AttributeError) as e:
+            _deepseek_log(f"[DeepSeek] ignoring routes in {self.path}: {e}")
+            configured = {}
+        for task, route in configured.items():
+            if not isinstance(route, dict):
+                _deepseek_log(f"[DeepSeek] route {task!r} must be an object; skipped")
+                continue
+            entry = routes.setdefault(task, {})
+            for key, value in route.items():
+                if key not in self.KEYS:
+                    _deepseek_log(f"[DeepSeek] route {task!r}: unknown key {key!r} ignored")
+                    continue
+                try:
+                    entry[key] = self.KEYS[key](value)
+                except (TypeError, ValueError):
+                    _deepseek_log(f"[DeepSeek] route {task!r}: bad {key} {value!r} ignored")
+        self.routes = routes
+        return routes
+
+    def route(self, task: str) -> dict:
+        return {**self.routes.get("default", {}), **self.routes.get(task, {})}
+
+    def apply(self, model: str, req: dict) -> tuple[str, dict]:
+        """Model and deepseek_chat kwargs for one request of the current task (see _deepseek_generator)."""
+        route = self.route(_deepseek_generator.get())
+        if not route:
+            return model, req
+        req = dict(req)
+        for key in ("temperature", "max_tokens", "timeout"):
+            if key in route:
+                req[key] = route[key]
+        return route.get("model", model), req
+
+
+DEEPSEEK_ROUTER = DeepSeekRouter(APP_CONFIG_PATH, DEEPSEEK_ROUTES)
+
+
+_deepseek_generator = contextvars.ContextVar("deepseek_generator", default="")
+_deepseek_item = contextvars.ContextVar("deepseek_item", default="")
+
+
+@contextlib.contextmanager
+def deepseek_item(label: str):
+    """Attribute every DeepSeek call made inside the block to one batch item (a date, a title...)."""
+    token = _deepseek_item.set(label)
+    try:
+        yield
+    finally:
+        _deepseek_item.reset(token)
+
+
+class DeepSeekRunStats:
+    """Per-run accounting of every deepseek_chat call: tokens, wall time, retries, generator and item."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.calls = []
+            self.prompt_cache_hit_tokens = 0
+            self.prompt_cache_miss_tokens = 0
+            self.expansions = []
+
+    def record_call(
+        self,
+        model: str,
+        seconds: float,
+        usage=None,
+        retries: int = 0,
+        cached: bool = False,
+        error=None,
+        finish_reason=None,
+    ):
+        usage = usage or {}
+        entry = {
+            "generator": _deepseek_generator.get() or "direct",
+            "item": _deepseek_item.get(),
+            "model": model,
+            "route": f"{_deepseek_generator.get() or 'direct'} -> {model}",
+            "prompt_tokens": usage.get("prompt_tokens", 0) or 0,
+            "completion_tokens": usage.get("completion_tokens", 0) or 0,
+            "seconds": round(seconds, 3),
+            "retries": retries,
+            "cached": cached,
+            "error": error,
+            "finish_reason": finish_reason,
+        }
+        with self._lock:
+            self.calls.append(entry)
+            self.prompt_cache_hit_tokens += usage.get("prompt_cache_hit_tokens", 0) or 0
+            self.prompt_cache_miss_tokens += usage.get("prompt_cache_miss_tokens", 0) or 0
+
+    def record_expansion(self, sent_tokens: int, full_resend_tokens: int):
+        """One "too short" retry sent as an expansion; full_resend_tokens is what resending the whole
+        conversation and rewriting the text would have cost (both estimated, prompt + completion)."""
+        with self._lock:
+            self.expansions.append({
+                "generator": _deepseek_generator.get() or "direct",
+                "item": _deepseek_item.get(),
+                "sent_tokens": sent_tokens,
+                "full_resend_tokens": full_resend_tokens,
+            })
+
+    def expansion_totals(self) -> dict:
+        with self._lock:
+            rows = list(self.expansions)
+        sent = sum(r["sent_tokens"] for r in rows)
+        full = sum(r["full_resend_tokens"] for r in rows)
+        return {"requests": len(rows), "sent_tokens": sent, "full_resend_tokens": full, "saved_tokens": full - sent}
+
+    def prompt_cache_ratio(self) -> float:
+        total = self.prompt_cache_hit_tokens + self.prompt_cache_miss_tokens
+        return self.prompt_cache_hit_tokens / total if total else 0.0
+
+    @staticmethod
+    def _totals(calls: list) -> dict:
+        return {
+            "calls": len(calls),
+            "cached": sum(1 for c in calls if c["cached"]),
+            "errors": sum(1 for c in calls if c["error"]),
+            "truncated": sum(1 for c in calls if c["finish_reason"] == "length"),
+            "retries": sum(c["retries"] for c in calls),
+            "prompt_tokens": sum(c["prompt_tokens"] for c in calls),
+            "completion_tokens": sum(c["completion_tokens"] for c in calls),
+            "seconds": round(sum(c["seconds"] for c in calls), 3),
+        }
+
+    @staticmethod
+    def _latency(calls: list) -> dict:
+        """Wall-time spread of the calls that actually went to the API (cache hits excluded)."""
+        times = sorted(c["seconds"] for c in calls if not c["cached"] and not c["error"])
+        if not times:
+            return {"mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+        return {
+            "mean": round(sum(times) / len(times), 3),
+            "p50": times[len(times) // 2],
+            "p95": times[min(len(times) - 1, int(len(times) * 0.95))],
+            "max": times[-1],
+        }
+
+    def _aggregate(self, calls: list, field: str) -> dict:
+        groups = {}
+        for c in calls:
+            groups.setdefault(c[field] or "-", []).append(c)
+        return {key: self._totals(group) for key, group in groups.items()}
+
+    def report(self, run: str) -> dict:
+        with self._lock:
+            calls = list(self.calls)
+        return {
+            "run": run,
+            "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+            "finished": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "totals": self._totals(calls),
+            "prompt_cache": {
+                "hit_tokens": self.prompt_cache_hit_tokens,
+                "miss_tokens": self.prompt_cache_miss_tokens,
+                "hit_ratio": round(self.prompt_cache_ratio(), 4),
+            },
+            "expansion": self.expansion_totals(),
+            "tokens_per_word": DEEPSEEK_TOKEN_BUDGETS.snapshot(),
+            "by_generator": self._aggregate(calls, "generator"),
+            "by_item": self._aggregate(calls, "item"),
+            "by_route": {
+                route: {**totals, "latency": self._latency([c for c in calls if c["route"] == route])}
+                for route, totals in self._aggregate(calls, "route").items()
+            },
+            "calls": calls,
+        }
+
+    def write_report(self, run: str) -> str:
+        report = self.report(run)
+        folder = os.path.join(APP_DATA_DIR, "reports")
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{run.lower()}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return path
+
+
+DEEPSEEK_RUN_STATS = DeepSeekRunStats()
+
+
+def _parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+        return max(0.0, when.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Exponential backoff with equal jitter: half fixed, half random."""
+    cap = min(DEEPSEEK_BACKOFF_MAX, DEEPSEEK_BACKOFF_BASE * (2 ** (attempt - 1)))
+    return cap / 2 + random.uniform(0, cap / 2)
+
+
+def _deepseek_post(api_key: str, payload: dict, timeout: float, on_delta=None, stop_when=None) -> dict:
+    """One HTTP attempt; raises DeepSeekAPIError on non-200."""
+    headers = {"Authorization": f"Bearer {api_key}"}
+    stream = bool(payload.get("stream"))
+    r = get_deepseek_session().post(DEEPSEEK_CHAT_ENDPOINT, headers=headers, json=payload, timeout=timeout, stream=stream)
     if r.status_code != 200:
         try:
             j = r.json()
         except Exception:
             j = {"raw": r.text}
-        raise RuntimeError(f"DeepSeek API error HTTP {r.status_code}: {j}")
+        raise DeepSeekAPIError(r.status_code, j, _parse_retry_after(r.headers.get("Retry-After")))
+    if stream:
+        return _read_chat_stream(r, on_delta=on_delta, stop_when=stop_when)
     return r.json()
 
 
-def word_count(s: str) -> int:
-    if re.search(r"[A-Za-z]", s):
-        return len(re.findall(r"[A-Za-z0-9]+(?:'[A-Za-z0-9]+)?", s))
-    return len(re.findall(r"\S", s))
+def _deepseek_chat_with_retries(
+    api_key: str, payload: dict, call: dict, on_delta=None, stop_when=None, timeout: float = DEEPSEEK_TIMEOUT
+) -> dict:
+    """Retry loop around _deepseek_post; call["retries"] is kept current even when it finally raises."""
+    estimated = estimate_tokens(payload["messages"]) + payload["max_tokens"]
+    per_attempt = timeout
+    deadline = time.monotonic() + DEEPSEEK_CALL_DEADLINE
+    attempt = 0
+    timeouts = 0
+    while True:
+        attempt += 1
+        call["retries"] = attempt - 1
+        probe = DEEPSEEK_BREAKER.before_call()
+        try:
+            waited = DEEPSEEK_RATE_LIMITER.acquire(estimated, timeout=deadline - time.monotonic())
+            if waited >= 2:
+                _deepseek_log(f"[DeepSeek] rate limiter held the call for {waited:.1f}s")
+            timeout = min(per_attempt, max(1.0, deadline - time.monotonic()))
+            if probe:
+                timeout = min(timeout, DEEPSEEK_BREAKER_PROBE_TIMEOUT)
+            resp = _deepseek_post(api_key, payload, timeout, on_delta=on_delta, stop_when=stop_when)
+            DEEPSEEK_BREAKER.record_success()
+            usage = resp.get("usage") or {}
+            DEEPSEEK_RATE_LIMITER.settle(estimated, usage.get("total_tokens", 0))
+            return resp
+        except requests.Timeout as e:
+            DEEPSEEK_BREAKER.record_failure()
+            timeouts += 1
+            if timeouts >= DEEPSEEK_MAX_TIMEOUTS:
+                raise RuntimeError(f"DeepSeek timed out {timeouts} times: {e}") from e
+            reason, delay = f"timeout after {timeout:.0f}s", _backoff_delay(attempt)
+        except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+            DEEPSEEK_BREAKER.record_failure()
+            reason, delay = f"connection error ({type(e).__name__})", _backoff_delay(attempt)
+        except DeepSeekAPIError as e:
+            if e.status_code not in DEEPSEEK_RETRY_STATUSES:
+                DEEPSEEK_BREAKER.record_success()  # the service answered; the request itself is wrong
+                raise
+            if e.status_code == 429:
+                DEEPSEEK_BREAKER.record_success()  # throttling is handled by the rate limiter, not the breaker
+            else:
+                DEEPSEEK_BREAKER.record_failure()
+            reason = "rate limited (HTTP 429)" if e.status_code == 429 else f"server error (HTTP {e.status_code})"
+            delay = e.retry_after if e.retry_after is not None else _backoff_delay(attempt)
+            if e.status_code == 429:
+                DEEPSEEK_RATE_LIMITER.pause(delay)
+        finally:
+            if probe:
+                DEEPSEEK_BREAKER.end_probe()
+
+        if attempt >= DEEPSEEK_MAX_ATTEMPTS or time.monotonic() + delay >= deadline:
+            raise RuntimeError(f"DeepSeek gave up after {attempt} attempts: {reason}")
+        if DEEPSEEK_BREAKER.retry_in() > 0:
+            raise DeepSeekCircuitOpen(DEEPSEEK_BREAKER.retry_in())
+        _deepseek_log(f"[DeepSeek] {reason}; retry {attempt}/{DEEPSEEK_MAX_ATTEMPTS - 1} in {delay:.1f}s")
+        time.sleep(delay)
+
+
+def deepseek_chat(
+    api_key: str,
+    model: str,
+    messages: list,
+    temperature: float = 0.5,
+    max_tokens: int = 600,
+    stream: bool = False,
+    on_delta=None,
+    stop_when=None,
+    response_format: dict = None,
+    cache_salt: str = "",
+    timeout: float = DEEPSEEK_TIMEOUT,
+) -> dict:
+    """POST a chat completion. With stream=True the body is read as SSE: on_delta(text_so_far) is called
+    per chunk and the stream is closed as soon as stop_when(text_so_far) returns True.
+
+    Responses are served from DEEPSEEK_CACHE when the same payload was answered before.
+    429/5xx, dropped connections and timeouts are retried with backoff (Retry-After wins when sent)
+    until DEEPSEEK_MAX_ATTEMPTS or the DEEPSEEK_CALL_DEADLINE budget runs out; while DEEPSEEK_BREAKER
+    is open, calls fail fast with DeepSeekCircuitOpen.
+    Every call, cached or failed, is recorded in DEEPSEEK_RUN_STATS; completed answers also feed
+    DEEPSEEK_TOKEN_BUDGETS."""
+    payload = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+    if response_format:
+        payload["response_format"] = response_format
+    if stream:
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
+
+    start = time.monotonic()
+    cache_key = DEEPSEEK_CACHE.key(payload, cache_salt)
+    cached = DEEPSEEK_CACHE.get(cache_key, max_tokens)
+    if cached is not None:
+        if on_delta:
+            on_delta(cached["choices"][0]["message"]["content"])
+        DEEPSEEK_RUN_STATS.record_call(model, time.monotonic() - start, cached=True)
+        return cached
+
+    call = {"retries": 0}
+    try:
+        resp = _deepseek_chat_with_retries(
+            api_key, payload, call, on_delta=on_delta, stop_when=stop_when, timeout=timeout
+        )
+    except Exception as e:
+        DEEPSEEK_RUN_STATS.record_call(model, time.monotonic() - start, retries=call["retries"], error=str(e))
+        raise
+    DEEPSEEK_RUN_STATS.record_call(
+        model, time.monotonic() - start, resp.get("usage"), retries=call["retries"],
+        finish_reason=resp["choices"][0].get("finish_reason"),
+    )
+    DEEPSEEK_CACHE.put(cache_key, resp, max_tokens)
+    choice = resp["choices"][0]
+    if choice.get("finish_reason") == "stop" and not resp.get("stopped_early"):
+        # Truncated and early-stopped answers would skew the ratio low.
+        DEEPSEEK_TOKEN_BUDGETS.observe(
+            _deepseek_generator.get(),
+            (resp.get("usage") or {}).get("completion_tokens", 0) or 0,
+            choice["message"]["content"],
+        )
+    return resp
+
+
+_deepseek_semaphores = weakref.WeakKeyDictionary()
+_deepseek_semaphores_lock = threading.Lock()
+
+
+def _deepseek_semaphore() -> asyncio.Semaphore:
+    """Per-event-loop semaphore capping concurrent DeepSeek requests at DEEPSEEK_MAX_CONCURRENCY."""
+    loop = asyncio.get_running_loop()
+    with _deepseek_semaphores_lock:
+        sem = _deepseek_semaphores.get(loop)
+        if sem is None:
+            sem = _deepseek_semaphores[loop] = asyncio.Semaphore(DEEPSEEK_MAX_CONCURRENCY)
+        return sem
 
 
-def parse_json_object(text: str) -> dict:
-    cleaned = text.strip()
-    if cleaned.startswith("```"):
-        cleaned = re.sub(r"^```[a-zA-Z0-9]*\n", "", cleaned)
-        cleaned = re.sub(r"\n```$", "", cleaned)
-        cleaned = cleaned.strip()
+async def deepseek_chat_async(
+    api_key: str, model: str, messages: list, temperature: float = 0.5, max_tokens: int = 600, **kwargs
+) -> dict:
+    """Async deepseek_chat: the blocking call runs on the pooled session in a worker thread."""
+    async with _deepseek_semaphore():
+        loop = asyncio.get_running_loop()
+        # run_in_executor does not carry contextvars over; copy them so run stats see generator/item.
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(
+            None, functools.partial(ctx.run, deepseek_chat, api_key, model, messages, temperature, max_tokens, **kwargs)
+        )
+
+
+def _steps_name(steps) -> str:
+    return steps.__name__.strip("_").removesuffix("_steps")
+
+
+def _candidate_requests(request: dict, n: int) -> list:
+    """n copies of one request to be sent in parallel; DeepSeek has no n>1, so each is its own call."""
+    return [{**request, "cache_salt": f"candidate-{i}"} for i in range(n)]
+
+
+def _candidate_results(results: list) -> list:
+    """Failed candidates come back as None; only when every one failed is the first error raised."""
+    if all(isinstance(r, BaseException) for r in results):
+        raise results[0]
+    return [None if isinstance(r, BaseException) else r for r in results]
+
+
+def _subtask_steps(task: str, steps):
+    """Delegate to nested steps as their own task (e.g. the summary repair inside _reflection_steps).
+    `task` is current while they build their requests, and every request they yield carries it, so
+    routing, run stats and token budgets see the sub-task instead of the enclosing generator."""
+    resp = None
+    while True:
+        token = _deepseek_generator.set(task)
+        try:
+            req = steps.send(resp)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            _deepseek_generator.reset(token)
+        resp = yield [{**r, "task": task} for r in req] if isinstance(req, list) else {**req, "task": task}
+
+
+@contextlib.contextmanager
+def _request_task(req: dict):
+    """Make a request's "task" label (see _subtask_steps) current for the call; yields the request without it."""
+    task = req.get("task")
+    if not task:
+        yield req
+        return
+    token = _deepseek_generator.set(task)
     try:
-        return json.loads(cleaned)
-    except Exception:
-        m = re.search(r"\{.*\}", cleaned, re.S)
-        if not m:
-            raise ValueError("No JSON object found in response.")
-        return json.loads(m.group(0))
+        yield {k: v for k, v in req.items() if k != "task"}
+    finally:
+        _deepseek_generator.reset(token)
+
+
+def _chat_one(api_key: str, model: str, req: dict) -> dict:
+    with _request_task(req) as req:
+        routed, req = DEEPSEEK_ROUTER.apply(model, req)
+        return deepseek_chat(api_key, routed, **req)
+
+
+async def _chat_one_async(api_key: str, model: str, req: dict) -> dict:
+    with _request_task(req) as req:
+        routed, req = DEEPSEEK_ROUTER.apply(model, req)
+        return await deepseek_chat_async(api_key, routed, **req)
+
+
+def _chat_round(api_key: str, model: str, req):
+    if not isinstance(req, list):
+        return _chat_one(api_key, model, req)
+    with concurrent.futures.ThreadPoolExecutor(len(req)) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, _chat_one, api_key, model, r) for r in req]
+    return _candidate_results([f.exception() or f.result() for f in futures])
+
+
+async def _chat_round_async(api_key: str, model: str, req):
+    if not isinstance(req, list):
+        return await _chat_one_async(api_key, model, req)
+    results = await asyncio.gather(*(_chat_one_async(api_key, model, r) for r in req), return_exceptions=True)
+    return _candidate_results(results)
+
+
+def _run_chat_steps(api_key: str, model: str, steps):
+    """Drive a generator that yields deepseek_chat kwargs and receives the responses.
+    A yielded list of requests runs in parallel and is answered with a list (see _candidate_requests)."""
+    token = _deepseek_generator.set(_steps_name(steps))
+    try:
+        req = next(steps)
+        while True:
+            req = steps.send(_chat_round(api_key, model, req))
+    except StopIteration as stop:
+        return stop.value
+    finally:
+        _deepseek_generator.reset(token)
+
+
+async def _run_chat_steps_async(api_key: str, model: str, steps):
+    token = _deepseek_generator.set(_steps_name(steps))
+    try:
+        req = next(steps)
+        while True:
+            req = steps.send(await _chat_round_async(api_key, model, req))
+    except StopIteration as stop:
+        return stop.value
+    finally:
+        _deepseek_generator.reset(token)
 
 
 # -----------------------------
 # DeepSeek generation
 # -----------------------------
 
-def generate_activity_record_deepseek(
-    api_key: str,
+# System prompts carry every fixed rule, so all calls of a generator share one long prefix
+# that DeepSeek can serve from its prompt cache; the per-item details follow in the user turn.
+ACTIVITY_RECORD_SYSTEM_PROMPT = (
+    "You write IB CAS Activity Records. Output ONLY the final prose (no headings/labels/prefaces). "
+    "Prioritize concrete, evidence-based details; generic clichés only allowed in the last 1–2 sentences.\n\n"
+    "Hard output rules (MUST follow):\n"
+    "- Output ONLY the final record text.\n"
+    "- Do NOT add a title, labels (e.g., 'Record:'), prefaces, explanations, word counts, or any extra lines.\n"
+    "- No bullet points, no markdown, no quotes.\n\n"
+    "Content requirements:\n"
+    "- English, realistic high school tone.\n"
+    "- 1–2 coherent paragraphs, at the length given in the request.\n"
+    "- The first 80% of the text must be concrete and specific: include at least 3–5 details "
+    "(what exactly I did, what material/topic I covered, what example I used, what question I handled, what I changed/improved).\n"
+    "- If this is a history-related activity (e.g., speech/lecture/presentation), include at least TWO specific pieces of history knowledge "
+    "(e.g., a named event/person, a date/time range, a cause-effect claim, a key term, a historiographical point) that I learned or used.\n"
+    "- Only in the LAST 1–2 sentences, allow brief general reflection (impact/next steps). Avoid generic clichés elsewhere."
+)
+
+WEEKLY_THEME_SYSTEM_PROMPT = (
+    "Create ONE unique Activity theme and Activity Description for the club given by the user.\n"
+    "Return ONLY a valid JSON object with exactly two string keys: theme and description.\n"
+    "Rules:\n"
+    "- theme: 4-10 words, English, no date, no quotes.\n"
+    "- description: English, single paragraph, more than 80 words.\n"
+    "- Include at least 3 concrete details (what I did, materials/topics, specific examples, or changes).\n"
+    "- If a periodic activity is provided, keep it consistent but vary the details week to week.\n"
+    "- Avoid repetition across entries. Do NOT reuse any themes, topics, or examples listed under Avoid.\n"
+    "- Vary the activity focus across weeks (e.g., discussion, research, source analysis, workshop, debate, planning).\n"
+    "- No bullet points, no markdown, no labels."
+)
+
+REFLECTION_SUMMARY_SYSTEM_PROMPT = (
+    "Return exactly one natural English sentence only. No labels, no preface, no extra text.\n\n"
+    "Hard output rules (MUST follow):\n"
+    "- Output ONLY ONE sentence and NOTHING ELSE.\n"
+    "- Do NOT add 'Summary:' or any label, no quotes, no extra whitespace lines.\n"
+    "- No bullet points, no markdown.\n\n"
+    "Length/style requirements:\n"
+    "- About 20 words (target 18–22 words).\n"
+    "- Must end with punctuation."
+)
+
+REFLECTION_CONTENT_SYSTEM_PROMPT = (
+    "You write long-form IB CAS reflections. Output ONLY the final body text (no headings/labels/prefaces). "
+    "Front-load concrete details and evidence; generic wrap-up only allowed in the last paragraph.\n\n"
+    "Hard output rules (MUST follow):\n"
+    "- Output ONLY the reflection body text.\n"
+    "- Do NOT add a title, labels (e.g., 'Reflection:'), section headers, prefaces, explanations, or word counts.\n"
+    "- No bullet points, no markdown, no quotes.\n\n"
+    "Structure/length:\n"
+    "- At least 550 words (target 600–750).\n"
+    "- 4–7 paragraphs.\n\n"
+    "Content requirements (anti-generic):\n"
+    "- The first 70–85% must be specific and evidence-based: include at least 6–10 concrete details "
+    "(exact tasks, decisions, what I said/did, what feedback I received, what I changed, specific examples).\n"
+    "- If this is history-related (speech/lecture/presentation), include at least TWO concrete history takeaways "
+    "(named event/person, date/time range, causation argument, key term, or historiographical insight) and explain how they shaped my thinking.\n"
+    "- Only in the FINAL paragraph, allow brief general statements about growth/impact/next steps; avoid generic phrases elsewhere."
+)
+
+
+REFLECTION_SYSTEM_PROMPT = (
+    "You write IB CAS reflections. Return ONLY a valid JSON object with exactly two string keys, "
+    "in this order: summary, then content.\n\n"
+    "summary:\n"
+    "- Exactly one natural English sentence, about 20 words (target 18–22 words), ending with punctuation.\n"
+    "- No labels, no quotes, no bullet points.\n\n"
+    "content (the reflection body; separate paragraphs with \\n\\n):\n"
+    "- At least 550 words (target 600–750), 4–7 paragraphs.\n"
+    "- No title, labels, section headers, prefaces, explanations, word counts, bullet points or markdown.\n"
+    "- Front-load concrete details and evidence: the first 70–85% must include at least 6–10 concrete details "
+    "(exact tasks, decisions, what I said/did, what feedback I received, what I changed, specific examples).\n"
+    "- If this is history-related (speech/lecture/presentation), include at least TWO concrete history takeaways "
+    "(named event/person, date/time range, causation argument, key term, or historiographical insight) and explain how they shaped my thinking.\n"
+    "- Only in the FINAL paragraph, allow brief general statements about growth/impact/next steps; avoid generic phrases elsewhere."
+)
+
+SUMMARY_REVISE_PROMPT = "Revise: 1 sentence, 18–22 words, end with punctuation, no bullets, no extra text."
+
+
+def _reflection_context(club_name: str, title: str, club_desc: str, reflection_desc: str) -> str:
+    # Most stable first (club, club description), most variable last (title, focus).
+    lines = [f"Club: {club_name}"]
+    if club_desc:
+        lines.append(f"Club description: {club_desc}")
+    lines.append(f"Title: {title}")
+    if reflection_desc:
+        lines.append(f"Reflection focus: {reflection_desc}")
+    return "\n".join(lines)
+
+
+def _chat_until_done(request: dict, max_continuations: int = DEEPSEEK_MAX_CONTINUATIONS):
+    """Yield one chat request; when the answer stopped at max_tokens (finish_reason "length"),
+    ask for the rest and stitch it on instead of regenerating. Returns the stitched response."""
+    resp = yield request
+    text = resp["choices"][0]["message"]["content"]
+    for _ in range(max_continuations):
+        if resp["choices"][0].get("finish_reason") != "length":
+            break
+        # Drop the half-written last word so the continuation starts on a word boundary.
+        cut = max(text.rfind(" "), text.rfind("\n"))
+        if cut > 0:
+            sep = "\n\n" if text[cut] == "\n" else " "
+            text = text[:cut].rstrip()
+        else:
+            sep = ""
+        cont = {**request, "messages": request["messages"] + [
+            {"role": "assistant", "content": text},
+            {"role": "user", "content": (
+                "You were cut off by the length limit. Continue exactly where the text stops. "
+                "Output ONLY the remaining text; do not repeat anything already written."
+            )},
+        ]}
+        head = text + sep
+        if request.get("on_delta"):
+            cont["on_delta"] = lambda part, head=head: request["on_delta"](head + part)
+        if request.get("stop_when"):
+            cont["stop_when"] = lambda part, head=head: request["stop_when"](head + part)
+        resp = yield cont
+        text = head + resp["choices"][0]["message"]["content"].lstrip()
+    return {**resp, "choices": [{**resp["choices"][0], "message": {"role": "assistant", "content": text}}]}
+
+
+def _expansion_messages(first_messages: list, draft: str, more_words: int, where: str) -> list:
+    """Messages for a "too short" retry: the original request plus the current draft once, asking only for
+    the missing words. The earlier attempts are not resent and the model does not rewrite the whole text."""
+    system, request = first_messages
+    return [
+        system,
+        {"role": "user", "content": (
+            f"{request['content']}\n\n"
+            f"Current draft ({word_count(draft)} words):\n{draft}\n\n"
+            f"The draft is too short. Write about {more_words} more words of new, specific detail "
+            f"to be inserted {where}. Output ONLY the new text; do not repeat or rewrite the draft."
+        )},
+    ]
+
+
+def _splice_expansion(draft: str, addition: str, paragraphs: bool) -> str:
+    """Insert the expansion before the closing paragraph (or sentence), where the generic wrap-up lives."""
+    addition = addition.strip()
+    if not addition:
+        return draft
+    # The model occasionally ignores the instruction and returns a full rewrite; take it as the new draft.
+    if addition[:60] == draft[:60]:
+        return addition
+    if paragraphs:
+        parts = [p for p in re.split(r"\n\s*\n|\n", draft) if p.strip()]
+        if len(parts) < 2:
+            return f"{draft}\n\n{addition}"
+        return "\n\n".join(parts[:-1] + [addition, parts[-1]])
+    # Keep the separators so a multi-paragraph record keeps its line breaks; the addition joins the
+    # text before the closing sentence, which keeps whatever break preceded it.
+    parts = re.split(r"(?<=[.!?])(\s+)", draft.rstrip())
+    if len(parts) < 3:
+        return f"{draft.rstrip()} {addition}"
+    return "".join(parts[:-2]) + " " + addition + parts[-2] + parts[-1]
+
+
+def _expand_steps(
+    first_messages: list,
+    text: str,
+    min_words: int,
+    target_words: int,
+    where: str,
+    paragraphs: bool,
+    attempts: int,
+    temperature: float,
+    on_partial=None,
+):
+    """Shared "too short" loop: expand the draft until it reaches min_words (or attempts run out).
+    With on_partial the expansion is streamed and previewed already spliced into the draft.
+    Records the estimated saving against resending the full history in DEEPSEEK_RUN_STATS."""
+    resend = list(first_messages)
+    for _ in range(attempts):
+        if word_count(text) >= min_words:
+            break
+        resend += [
+            {"role": "assistant", "content": text},
+            {"role": "user", "content": f"Too short. Expand to about {target_words} words."},
+        ]
+        more = max(target_words - word_count(text), 30)
+        messages = _expansion_messages(first_messages, text, more, where)
+        request = {
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": DEEPSEEK_TOKEN_BUDGETS.max_tokens(_deepseek_generator.get(), more + 20),
+        }
+        if on_partial:
+            request.update(stream=True, on_delta=lambda part, draft=text: on_partial(
+                _splice_expansion(draft, part, paragraphs)
+            ))
+        resp = yield from _chat_until_done(request)
+        addition = resp["choices"][0]["message"]["content"].strip()
+        expanded = _splice_expansion(text, addition, paragraphs)
+        DEEPSEEK_RUN_STATS.record_expansion(
+            estimate_tokens(messages) + estimate_tokens([{"content": addition}]),
+            estimate_tokens(resend) + estimate_tokens([{"content": expanded}]),
+        )
+        text = expanded
+    return text
+
+
+def _activity_record_steps(
     club_name: str,
     date_ymd: str,
     theme: str,
     c_hours: str,
     a_hours: str,
     s_hours: str,
-    model: str = "deepseek-chat",
-) -> str:
+):
     is_conversation = club_name.strip() == CONVERSATION_CLUB
     min_words = 175 if is_conversation else 100
+    max_words = 220 if is_conversation else 180
     word_target = "180每220" if is_conversation else "120每180"
+    # Variable parts go last so the system rules stay a byte-identical, cacheable prefix.
     user_content = (
         f"Write an IB CAS Activity Record for the club '{club_name}'.\n"
+        f"Length: {word_target} words (must be >= {min_words} words).\n"
         f"Context:\n"
         f"- Date: {date_ymd}\n"
         f"- Activity theme: {theme}\n"
-        f"- Hours: C={c_hours}, A={a_hours}, S={s_hours}\n\n"
-        f"Hard output rules (MUST follow):\n"
-        f"- Output ONLY the final record text.\n"
-        f"- Do NOT add a title, labels (e.g., 'Record:'), prefaces, explanations, word counts, or any extra lines.\n"
-        f"- No bullet points, no markdown, no quotes.\n\n"
-        f"Content requirements:\n"
-        f"- English, realistic high school tone.\n"
-        f"- 1–2 coherent paragraphs.\n"
-        f"- {word_target} words (must be >= {min_words} words).\n"
-        f"- The first 80% of the text must be concrete and specific: include at least 3–5 details "
-        f"(what exactly I did, what material/topic I covered, what example I used, what question I handled, what I changed/improved).\n"
-        f"- If this is a history-related activity (e.g., speech/lecture/presentation), include at least TWO specific pieces of history knowledge "
-        f"(e.g., a named event/person, a date/time range, a cause-effect claim, a key term, a historiographical point) that I learned or used.\n"
-        f"- Only in the LAST 1–2 sentences, allow brief general reflection (impact/next steps). Avoid generic clichés elsewhere."
+        f"- Hours: C={c_hours}, A={a_hours}, S={s_hours}"
     )
 
-
     messages = [
-    {"role": "system", "content": "You write IB CAS Activity Records. Output ONLY the final prose (no headings/labels/prefaces). Prioritize concrete, evidence-based details; generic clichés only allowed in the last 1–2 sentences."},
-    {"role": "user", "content": user_content},
+        {"role": "system", "content": ACTIVITY_RECORD_SYSTEM_PROMPT},
+        {"role": "user", "content": user_content},
     ]
 
+    resp = yield from _chat_until_done({
+        "messages": messages,
+        "temperature": 0.55,
+        "max_tokens": DEEPSEEK_TOKEN_BUDGETS.max_tokens("activity_record", max_words),
+    })
+    text = resp["choices"][0]["message"]["content"].strip()
+    return (yield from _expand_steps(
+        messages, text, min_words,
+        target_words=min_words + 25, where="before the draft's closing sentence",
+        paragraphs=False, attempts=2, temperature=0.55,
+    ))
 
-    last_text = ""
-    for _ in range(3):
-        resp = deepseek_chat(api_key, model, messages, temperature=0.55, max_tokens=360)
-        text = resp["choices"][0]["message"]["content"].strip()
-        last_text = text
-        if word_count(text) >= min_words:
-            return text
-        messages.append({"role": "assistant", "content": text})
-        messages.append({
-            "role": "user",
-            "content": f"Too short. Expand to {word_target} words, keep specific and realistic."
-        })
 
-    return last_text
+def generate_activity_record_deepseek(
+    api_key: str,
+    club_name: str,
+    date_ymd: str,
+    theme: str,
+    c_hours: str,
+    a_hours: str,
+    s_hours: str,
+    model: str = "deepseek-chat",
+) -> str:
+    return _run_chat_steps(api_key, model, _activity_record_steps(
+        club_name=club_name,
+        date_ymd=date_ymd,
+        theme=theme,
+        c_hours=c_hours,
+        a_hours=a_hours,
+        s_hours=s_hours,
+    ))
 
 
-def generate_weekly_theme_desc_deepseek(
+async def generate_activity_record_deepseek_async(
     api_key: str,
+    club_name: str,
+    date_ymd: str,
+    theme: str,
+    c_hours: str,
+    a_hours: str,
+    s_hours: str,
+    model: str = "deepseek-chat",
+) -> str:
+    return await _run_chat_steps_async(api_key, model, _activity_record_steps(
+        club_name=club_name,
+        date_ymd=date_ymd,
+        theme=theme,
+        c_hours=c_hours,
+        a_hours=a_hours,
+        s_hours=s_hours,
+    ))
+
+
+def _norm_theme(theme: str) -> str:
+    return re.sub(r"[^a-z0-9 ]", "", re.sub(r"\s+", " ", theme).strip().lower())
+
+
+def _theme_problem(theme: str, used_norm: set):
+    theme_wc = word_count(theme)
+    if not theme or theme_wc < 4 or theme_wc > 10:
+        return "theme must be 4-10 words."
+    if re.search(r"[\"“”]|\d{4}[/-]\d{1,2}", theme):
+        return "theme must not contain quotes or a date."
+    if theme.lower() in used_norm or _norm_theme(theme) in used_norm:
+        return "theme repeats a previous entry. Make it clearly different."
+    return None
+
+
+def validate_theme_desc(obj, used_norm: set, used_descs_norm: set) -> tuple[str, str]:
+    """Strict check of a weekly {theme, description} object; the ValueError text doubles as the revise prompt."""
+    if not isinstance(obj, dict) or set(obj) != {"theme", "description"}:
+        raise ValueError("return a JSON object with exactly the keys theme and description.")
+    if not isinstance(obj["theme"], str) or not isinstance(obj["description"], str):
+        raise ValueError("theme and description must both be JSON strings.")
+    theme = re.sub(r"\s+", " ", obj["theme"]).strip()
+    desc = re.sub(r"\s+", " ", obj["description"]).strip()
+
+    problem = _theme_problem(theme, used_norm)
+    if problem:
+        raise ValueError(problem)
+    if word_count(desc) <= 80:
+        raise ValueError("description must be more than 80 words, one paragraph.")
+    if desc.lower() in used_descs_norm:
+        raise ValueError("description repeats a previous entry. Write new content.")
+    return theme, desc
+
+
+def _weekly_theme_desc_steps(
     club_name: str,
     date_ymd: str,
     club_desc: str,
     periodic_desc: str,
     used_themes: list[str],
     used_descs=None,
-    model: str = "deepseek-chat",
-) -> tuple[str, str]:
+    candidates: int = DEEPSEEK_CANDIDATES,
+):
+    """The first round asks for `candidates` answers in parallel and keeps the first valid one."""
     avoid = "; ".join(used_themes[-8:]) if used_themes else "none"
-    periodic_line = f"- Periodic activity: {periodic_desc}" if periodic_desc else "- Periodic activity: none"
+    periodic_line = f"Periodic activity: {periodic_desc}" if periodic_desc else "Periodic activity: none"
     user_content = (
-        f"Create ONE unique Activity theme and Activity Description for the club '{club_name}'.\n"
+        f"Club: {club_name}\n"
         f"Club description: {club_desc}\n"
+        f"{periodic_line}\n"
         f"Date: {date_ymd}\n"
-        f"{periodic_line}\n\n"
-        f"Return a JSON object with keys theme and description only.\n"
-        f"Rules:\n"
-        f"- theme: 4-10 words, English, no date, no quotes.\n"
-        f"- description: English, single paragraph, more than 80 words.\n"
-        f"- Include at least 3 concrete details (what I did, materials/topics, specific examples, or changes).\n"
-        f"- If a periodic activity is provided, keep it consistent but vary the details week to week.\n"
-        f"- Avoid repetition across entries. Do NOT reuse any themes, topics, or examples from: {avoid}.\n"
-        f"- Vary the activity focus across weeks (e.g., discussion, research, source analysis, workshop, debate, planning).\n"
-        f"- No bullet points, no markdown, no labels."
+        f"Avoid: {avoid}"
     )
 
     messages = [
-        {"role": "system", "content": "Return ONLY a valid JSON object with keys theme and description."},
+        {"role": "system", "content": WEEKLY_THEME_SYSTEM_PROMPT},
         {"role": "user", "content": user_content},
     ]
 
@@ -257,157 +1502,950 @@ def generate_weekly_theme_desc_deepseek(
     last_theme = ""
     last_desc = ""
 
-    for _ in range(4):
-        resp = deepseek_chat(api_key, model, messages, temperature=0.6, max_tokens=320)
+    for attempt in range(4):
+        request = {
+            "messages": messages,
+            "temperature": 0.6,
+            "max_tokens": DEEPSEEK_TOKEN_BUDGETS.max_tokens("weekly_theme_desc", 140),
+            "response_format": {"type": "json_object"},
+        }
+        if attempt == 0 and candidates > 1:
+            resps = yield _candidate_requests(request, candidates)
+        else:
+            resps = [(yield request)]
+        problem = None
+        for resp in filter(None, resps):
+            raw = resp["choices"][0]["message"]["content"].strip()
+            try:
+                obj = json.loads(raw)
+            except json.JSONDecodeError:
+                obj = None
+            try:
+                if isinstance(obj, dict):
+                    last_theme = re.sub(r"\s+", " ", str(obj.get("theme", ""))).strip()
+                    last_desc = re.sub(r"\s+", " ", str(obj.get("description", ""))).strip()
+                return validate_theme_desc(obj, used_norm, used_descs_norm)
+            except ValueError as e:
+                problem = problem or (raw, e)
+        raw, e = problem
+        messages.append({"role": "assistant", "content": raw})
+        messages.append({"role": "user", "content": f"Revise: {e}"})
+
+    return last_theme, last_desc
+
+
+def generate_weekly_theme_desc_deepseek(
+    api_key: str,
+    club_name: str,
+    date_ymd: str,
+    club_desc: str,
+    periodic_desc: str,
+    used_themes: list[str],
+    used_descs=None,
+    model: str = "deepseek-chat",
+) -> tuple[str, str]:
+    return _run_chat_steps(api_key, model, _weekly_theme_desc_steps(
+        club_name=club_name,
+        date_ymd=date_ymd,
+        club_desc=club_desc,
+        periodic_desc=periodic_desc,
+        used_themes=used_themes,
+        used_descs=used_descs,
+    ))
+
+
+async def generate_weekly_theme_desc_deepseek_async(
+    api_key: str,
+    club_name: str,
+    date_ymd: str,
+    club_desc: str,
+    periodic_desc: str,
+    used_themes: list[str],
+    used_descs=None,
+    model: str = "deepseek-chat",
+) -> tuple[str, str]:
+    return await _run_chat_steps_async(api_key, model, _weekly_theme_desc_steps(
+        club_name=club_name,
+        date_ymd=date_ymd,
+        club_desc=club_desc,
+        periodic_desc=periodic_desc,
+        used_themes=used_themes,
+        used_descs=used_descs,
+    ))
+
+
+WEEKLY_PLAN_SYSTEM_PROMPT = (
+    "Plan a term of weekly Activity themes for the club given by the user, one theme per listed date.\n"
+    "Return ONLY a valid JSON object of the form {\"themes\": [\"...\", \"...\"]} with exactly one theme per date, in date order.\n"
+    "Rules:\n"
+    "- Each theme: 4-10 words, English, no date, no quotes.\n"
+    "- Every theme must be clearly different from all the others (topic, material and activity type).\n"
+    "- If a periodic activity is provided, keep it consistent but vary the focus week to week.\n"
+    "- Vary the activity focus across weeks (e.g., discussion, research, source analysis, workshop, debate, planning)."
+)
+
+WEEKLY_DESCRIPTION_SYSTEM_PROMPT = (
+    "Write the Activity Description for one week of the club given by the user.\n"
+    "Output ONLY the description text: English, single paragraph, more than 80 words (target 90-130).\n"
+    "- Include at least 3 concrete details (what I did, materials/topics, specific examples, or changes).\n"
+    "- Stay on this week's theme; do not cover the topics of the other weeks listed.\n"
+    "- If a periodic activity is provided, keep it consistent with it.\n"
+    "- No bullet points, no markdown, no labels, no quotes."
+)
+
+
+def _weekly_plan_steps(club_name: str, club_desc: str, periodic_desc: str, dates: list[str]):
+    """One structured call for all N themes; only invalid or duplicate slots are sent back for repair."""
+    periodic_line = f"Periodic activity: {periodic_desc}" if periodic_desc else "Periodic activity: none"
+    user_content = (
+        f"Club: {club_name}\n"
+        f"Club description: {club_desc}\n"
+        f"{periodic_line}\n"
+        f"Dates ({len(dates)}): {', '.join(dates)}"
+    )
+    messages = [
+        {"role": "system", "content": WEEKLY_PLAN_SYSTEM_PROMPT},
+        {"role": "user", "content": user_content},
+    ]
+
+    themes = [""] * len(dates)
+    for _ in range(3):
+        resp = yield {
+            "messages": messages,
+            "temperature": 0.7,
+            "max_tokens": DEEPSEEK_TOKEN_BUDGETS.max_tokens("weekly_plan", 12 * len(dates) + 10),
+            "response_format": {"type": "json_object"},
+        }
         raw = resp["choices"][0]["message"]["content"].strip()
         try:
-            obj = parse_json_object(raw)
-            theme = str(obj.get("theme", "")).strip()
-            desc = str(obj.get("description", "")).strip()
-        except Exception:
+            proposed = json.loads(raw).get("themes")
+        except (json.JSONDecodeError, AttributeError):
+            proposed = None
+        if not isinstance(proposed, list) or len(proposed) != len(dates):
             messages.append({"role": "assistant", "content": raw})
-            messages.append({"role": "user", "content": "Return only valid JSON with keys theme and description."})
+            messages.append({"role": "user", "content": f"Revise: return {{\"themes\": [...]}} with exactly {len(dates)} strings."})
             continue
 
-        theme = re.sub(r"\s+", " ", theme)
-        desc = re.sub(r"\s+", " ", desc)
-        last_theme, last_desc = theme, desc
+        seen = set()
+        bad = []
+        for i, t in enumerate(proposed):
+            t = re.sub(r"\s+", " ", str(t)).strip()
+            if _theme_problem(t, seen):
+                themes[i] = ""  # never keep an earlier round's theme for a slot that failed this round
+                bad.append(i + 1)
+                continue
+            themes[i] = t
+            seen.add(_norm_theme(t))
+        if not bad:
+            return themes
+        messages.append({"role": "assistant", "content": raw})
+        messages.append({
+            "role": "user",
+            "content": f"Revise: replace the themes at positions {', '.join(map(str, bad))} (4-10 words, distinct "
+                       f"from every other theme); keep all other themes unchanged and return the full list.",
+        })
+
+    # Slots still empty are filled by the per-week generator.
+    return themes
+
+
+def _weekly_description_steps(
+    club_name: str,
+    club_desc: str,
+    periodic_desc: str,
+    date_ymd: str,
+    theme: str,
+    other_themes: list[str],
+):
+    periodic_line = f"Periodic activity: {periodic_desc}" if periodic_desc else "Periodic activity: none"
+    user_content = (
+        f"Club: {club_name}\n"
+        f"Club description: {club_desc}\n"
+        f"{periodic_line}\n"
+        f"Other weeks: {'; '.join(other_themes) or 'none'}\n"
+        f"Date: {date_ymd}\n"
+        f"This week's theme: {theme}"
+    )
+    messages = [
+        {"role": "system", "content": WEEKLY_DESCRIPTION_SYSTEM_PROMPT},
+        {"role": "user", "content": user_content},
+    ]
+
+    last = ""
+    for _ in range(3):
+        resp = yield from _chat_until_done({
+            "messages": messages,
+            "temperature": 0.6,
+            "max_tokens": DEEPSEEK_TOKEN_BUDGETS.max_tokens("weekly_description", 150),
+        })
+        text = re.sub(r"\s+", " ", resp["choices"][0]["message"]["content"]).strip().strip('"')
+        last = text
+        if word_count(text) > 80:
+            return text
+        messages.append({"role": "assistant", "content": text})
+        messages.append({"role": "user", "content": "Revise: description must be more than 80 words, one paragraph."})
+
+    return last
+
+
+def generate_weekly_plan_deepseek(
+    api_key: str,
+    club_name: str,
+    club_desc: str,
+    periodic_desc: str,
+    dates: list[str],
+    model: str = "deepseek-chat",
+) -> list[str]:
+    return _run_chat_steps(api_key, model, _weekly_plan_steps(club_name, club_desc, periodic_desc, dates))
+
+
+async def generate_weekly_plan_deepseek_async(
+    api_key: str,
+    club_name: str,
+    club_desc: str,
+    periodic_desc: str,
+    dates: list[str],
+    model: str = "deepseek-chat",
+) -> list[str]:
+    return await _run_chat_steps_async(api_key, model, _weekly_plan_steps(club_name, club_desc, periodic_desc, dates))
+
+
+async def generate_weekly_description_deepseek_async(
+    api_key: str,
+    club_name: str,
+    club_desc: str,
+    periodic_desc: str,
+    date_ymd: str,
+    theme: str,
+    other_themes: list[str],
+    model: str = "deepseek-chat",
+) -> str:
+    return await _run_chat_steps_async(api_key, model, _weekly_description_steps(
+        club_name=club_name,
+        club_desc=club_desc,
+        periodic_desc=periodic_desc,
+        date_ymd=date_ymd,
+        theme=theme,
+        other_themes=other_themes,
+    ))
+
+
+class WeeklyDraftPlan:
+    """Planned themes of one weekly batch plus the descriptions its drafts have claimed so far.
+
+    Drafts run concurrently on one event loop, so uniqueness is kept here: fallback weeks (slots the
+    planner left empty) take `fallback_lock` and see every theme and description already taken, and
+    each description is claimed before its draft is returned."""
+
+    def __init__(self, themes: list[str]):
+        self.themes = list(themes)
+        self.descs = []
+        self.fallback_lock = asyncio.Lock()
+
+    def claim_desc(self, desc: str) -> bool:
+        norm = desc.strip().lower()
+        if norm in {d.strip().lower() for d in self.descs}:
+            return False
+        self.descs.append(desc)
+        return True
+
+
+async def generate_weekly_draft_deepseek_async(
+    api_key: str,
+    club_name: str,
+    club_desc: str,
+    periodic_desc: str,
+    dates: list[str],
+    plan: WeeklyDraftPlan,
+    index: int,
+    model: str = "deepseek-chat",
+) -> tuple[str, str]:
+    """(theme, description) for dates[index] of a plan. A slot the planner left empty, or a
+    description that repeats another week's, falls back to the per-week theme+description generator."""
+    with deepseek_item(dates[index]):
+        if plan.themes[index]:
+            others = [t for j, t in enumerate(plan.themes) if j != index and t]
+            desc = await generate_weekly_description_deepseek_async(
+                api_key, club_name, club_desc, periodic_desc, dates[index], plan.themes[index], others, model
+            )
+            if plan.claim_desc(desc):
+                return plan.themes[index], desc
+        async with plan.fallback_lock:
+            theme, desc = await generate_weekly_theme_desc_deepseek_async(
+                api_key, club_name, dates[index], club_desc, periodic_desc,
+                used_themes=[t for j, t in enumerate(plan.themes) if j != index and t],
+                used_descs=plan.descs, model=model,
+            )
+            plan.themes[index] = theme
+            plan.claim_desc(desc)
+            return theme, desc
+
+
+def _clean_summary(text: str) -> str:
+    # keep only first line/sentence if model returns extras, then drop surrounding quotes
+    text = text.strip().split("\n")[0]
+    return re.sub(r"\s+", " ", text).strip().strip('"')
+
+
+def _summary_ok(text: str) -> bool:
+    return 18 <= word_count(text) <= 22 and text.endswith(('.', '!', '?'))
+
+
+def _reflection_summary_steps(
+    club_name: str,
+    title: str,
+    club_desc: str = "",
+    reflection_desc: str = "",
+    draft: str = "",
+    candidates: int = DEEPSEEK_CANDIDATES,
+):
+    """With a draft (e.g. the summary from a combined reflection call) the first request is already a revision.
+    The first round asks for `candidates` answers in parallel; later rounds revise the closest one."""
+    user_content = _reflection_context(club_name, title, club_desc, reflection_desc)
+    messages = [
+        {"role": "system", "content": REFLECTION_SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Write a concise English summary for an IB CAS reflection.\n{user_content}"},
+    ]
+    if draft:
+        messages.append({"role": "assistant", "content": draft})
+        messages.append({"role": "user", "content": SUMMARY_REVISE_PROMPT})
+
+    last = draft
+    for attempt in range(3 if draft else 4):
+        request = {
+            "messages": messages,
+            "temperature": 0.45,
+            "max_tokens": DEEPSEEK_TOKEN_BUDGETS.max_tokens("reflection_summary", 30),
+        }
+        if attempt == 0 and candidates > 1:
+            resps = yield _candidate_requests(request, candidates)
+        else:
+            resps = [(yield request)]
+        texts = [_clean_summary(r["choices"][0]["message"]["content"]) for r in resps if r]
+        for text in texts:
+            if _summary_ok(text):
+                return text
+        text = min(texts, key=lambda t: abs(word_count(t) - 20))
+        last = text
+
+        messages.append({"role": "assistant", "content": text})
+        messages.append({"role": "user", "content": SUMMARY_REVISE_PROMPT})
+
+    return last
+
+
+def generate_reflection_summary_deepseek(
+    api_key: str,
+    club_name: str,
+    title: str,
+    club_desc: str = "",
+    reflection_desc: str = "",
+    model: str = "deepseek-chat",
+) -> str:
+    return _run_chat_steps(api_key, model, _reflection_summary_steps(
+        club_name=club_name,
+        title=title,
+        club_desc=club_desc,
+        reflection_desc=reflection_desc,
+    ))
+
+
+async def generate_reflection_summary_deepseek_async(
+    api_key: str,
+    club_name: str,
+    title: str,
+    club_desc: str = "",
+    reflection_desc: str = "",
+    model: str = "deepseek-chat",
+) -> str:
+    return await _run_chat_steps_async(api_key, model, _reflection_summary_steps(
+        club_name=club_name,
+        title=title,
+        club_desc=club_desc,
+        reflection_desc=reflection_desc,
+    ))
+
+
+def _completed_paragraphs(text: str) -> str:
+    return text[:text.rfind("\n")].strip() if "\n" in text else ""
+
+
+def _reflection_stream_done(text: str) -> bool:
+    """Early-stop rule for streamed reflections: the finished paragraphs already reach the 750-word ceiling."""
+    return "\n" in text[-60:] and word_count(_completed_paragraphs(text)) >= 750
+
+
+def _reflection_content_steps(
+    club_name: str,
+    title: str,
+    club_desc: str = "",
+    reflection_desc: str = "",
+    stream: bool = False,
+    on_partial=None,
+):
+    user_content = _reflection_context(club_name, title, club_desc, reflection_desc)
+    messages = [
+        {"role": "system", "content": REFLECTION_CONTENT_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Write an IB CAS Activity Reflection in English.\n{user_content}"},
+    ]
 
-        theme_wc = word_count(theme)
-        if not theme or theme_wc < 4 or theme_wc > 10:
-            messages.append({"role": "assistant", "content": raw})
-            messages.append({"role": "user", "content": "Revise: theme must be 4-10 words."})
-            continue
+    request = {
+        "messages": messages,
+        "temperature": 0.55,
+        "max_tokens": DEEPSEEK_TOKEN_BUDGETS.max_tokens("reflection_content", 800),
+    }
+    if stream:
+        request.update(stream=True, on_delta=on_partial, stop_when=_reflection_stream_done)
 
-        if theme.strip().lower() in used_norm:
-            messages.append({"role": "assistant", "content": raw})
-            messages.append({"role": "user", "content": "Revise: theme repeats a previous entry. Make it clearly different."})
-            continue
+    resp = yield from _chat_until_done(request)
+    text = resp["choices"][0]["message"]["content"].strip()
+    if resp.get("stopped_early"):
+        text = _completed_paragraphs(text)
 
-        if word_count(desc) <= 80:
-            messages.append({"role": "assistant", "content": raw})
-            messages.append({"role": "user", "content": "Revise: description must be more than 80 words, one paragraph."})
-            continue
-        if desc.strip().lower() in used_descs_norm:
-            messages.append({"role": "assistant", "content": raw})
-            messages.append({"role": "user", "content": "Revise: description repeats a previous entry. Write new content."})
-            continue
+    return (yield from _expand_steps(
+        messages, text, 550,
+        target_words=650, where="as new paragraph(s) before the draft's final paragraph; no bullet points",
+        paragraphs=True, attempts=2, temperature=0.55, on_partial=on_partial if stream else None,
+    ))
 
-        return theme, desc
 
-    return last_theme, last_desc
+def generate_reflection_content_deepseek(
+    api_key: str,
+    club_name: str,
+    title: str,
+    club_desc: str = "",
+    reflection_desc: str = "",
+    model: str = "deepseek-chat",
+    stream: bool = False,
+    on_partial=None,
+) -> str:
+    return _run_chat_steps(api_key, model, _reflection_content_steps(
+        club_name=club_name,
+        title=title,
+        club_desc=club_desc,
+        reflection_desc=reflection_desc,
+        stream=stream,
+        on_partial=on_partial,
+    ))
 
 
-def generate_reflection_summary_deepseek(
+async def generate_reflection_content_deepseek_async(
     api_key: str,
     club_name: str,
     title: str,
     club_desc: str = "",
     reflection_desc: str = "",
     model: str = "deepseek-chat",
+    stream: bool = False,
+    on_partial=None,
 ) -> str:
-    extra_context = ""
-    if club_desc:
-        extra_context += f"Club description: {club_desc}\n"
-    if reflection_desc:
-        extra_context += f"Reflection focus: {reflection_desc}\n"
-    user_content = (
-    f"Write a concise English summary for an IB CAS reflection.\n"
-    f"Club: {club_name}\n"
-    f"Title: {title}\n\n"
-    f"{extra_context}"
-    f"Hard output rules (MUST follow):\n"
-    f"- Output ONLY ONE sentence and NOTHING ELSE.\n"
-    f"- Do NOT add 'Summary:' or any label, no quotes, no extra whitespace lines.\n"
-    f"- No bullet points, no markdown.\n\n"
-    f"Length/style requirements:\n"
-    f"- About 20 words (target 18–22 words).\n"
-    f"- Must end with punctuation."
-    )
+    return await _run_chat_steps_async(api_key, model, _reflection_content_steps(
+        club_name=club_name,
+        title=title,
+        club_desc=club_desc,
+        reflection_desc=reflection_desc,
+        stream=stream,
+        on_partial=on_partial,
+    ))
 
 
-    messages = [
-    {"role": "system", "content": "Return exactly one natural English sentence only. No labels, no preface, no extra text."},
-    {"role": "user", "content": user_content},
-]
+_JSON_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}
 
 
-    last = ""
-    for _ in range(4):
-        resp = deepseek_chat(api_key, model, messages, temperature=0.45, max_tokens=80)
-        text = resp["choices"][0]["message"]["content"].strip()
-        text = re.sub(r"\s+", " ", text)
-        last = text
+def _partial_json_string(raw: str, key: str) -> str:
+    """Decode the (possibly unfinished) string value of `key` from a JSON object still being streamed."""
+    m = re.search(r'"%s"\s*:\s*"' % re.escape(key), raw)
+    if not m:
+        return ""
+    out = []
+    i = m.end()
+    while i < len(raw):
+        ch = raw[i]
+        if ch == '"':
+            break
+        if ch != "\\":
+            out.append(ch)
+            i += 1
+            continue
+        if i + 1 >= len(raw):
+            break
+        esc = raw[i + 1]
+        if esc == "u":
+            try:
+                out.append(chr(int(raw[i + 2:i + 6], 16)))
+            except ValueError:
+                break  # escape cut off mid-stream
+            i += 6
+            continue
+        out.append(_JSON_ESCAPES.get(esc, esc))
+        i += 2
+    return "".join(out)
 
-        # keep only first line/sentence if model returns extras
-        text = text.split("\n")[0].strip()
-        # remove leading/trailing quotes
-        text = text.strip('"')
 
-        wc = word_count(text)
-        if 18 <= wc <= 22 and text.endswith(('.', '!', '?')):
-            return text
+def _reflection_steps(
+    club_name: str,
+    title: str,
+    club_desc: str = "",
+    reflection_desc: str = "",
+    stream: bool = False,
+    on_partial=None,
+):
+    """Summary and body from one JSON call. Only a failing part costs another request:
+    the summary gets a revision turn, a short body goes through the usual expansion."""
+    user_content = _reflection_context(club_name, title, club_desc, reflection_desc)
+    messages = [
+        {"role": "system", "content": REFLECTION_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Write an IB CAS Activity Reflection in English.\n{user_content}"},
+    ]
 
-        messages.append({"role": "assistant", "content": text})
-        messages.append({
-            "role": "user",
-            "content": "Revise: 1 sentence, 18–22 words, end with punctuation, no bullets, no extra text."
-        })
+    request = {
+        "messages": messages,
+        "temperature": 0.55,
+        "max_tokens": DEEPSEEK_TOKEN_BUDGETS.max_tokens("reflection", 830),
+        "response_format": {"type": "json_object"},
+    }
+    if stream:
+        request.update(
+            stream=True,
+            on_delta=(lambda raw: on_partial(_partial_json_string(raw, "content"))) if on_partial else None,
+            stop_when=lambda raw: _reflection_stream_done(_partial_json_string(raw, "content")),
+        )
 
-    return last
+    resp = yield request
+    raw = resp["choices"][0]["message"]["content"]
+    try:
+        obj = json.loads(raw)
+        summary, content = str(obj.get("summary", "")), str(obj.get("content", ""))
+    except (json.JSONDecodeError, AttributeError):
+        # Stopped early or cut off at max_tokens: keep whatever finished.
+        summary, content = _partial_json_string(raw, "summary"), _partial_json_string(raw, "content")
+        content = _completed_paragraphs(content) or content
+    content = content.strip()
+
+    # Expansions use the plain-text body prompt, so the model is not asked for JSON again; they are
+    # routed and budgeted as reflection_content, the task that owns that prompt.
+    content = yield from _subtask_steps("reflection_content", _expand_steps(
+        [
+            {"role": "system", "content": REFLECTION_CONTENT_SYSTEM_PROMPT},
+            {"role": "user", "content": f"Write an IB CAS Activity Reflection in English.\n{user_content}"},
+        ],
+        content, 550,
+        target_words=650, where="as new paragraph(s) before the draft's final paragraph; no bullet points",
+        paragraphs=True, attempts=2, temperature=0.55, on_partial=on_partial if stream else None,
+    ))
+
+    summary = _clean_summary(summary)
+    if not _summary_ok(summary):
+        summary = yield from _subtask_steps("reflection_summary", _reflection_summary_steps(
+            club_name, title, club_desc, reflection_desc, draft=summary
+        ))
+    return summary, content
+
+
+def generate_reflection_deepseek(
+    api_key: str,
+    club_name: str,
+    title: str,
+    club_desc: str = "",
+    reflection_desc: str = "",
+    model: str = "deepseek-chat",
+    stream: bool = False,
+    on_partial=None,
+) -> tuple[str, str]:
+    return _run_chat_steps(api_key, model, _reflection_steps(
+        club_name=club_name,
+        title=title,
+        club_desc=club_desc,
+        reflection_desc=reflection_desc,
+        stream=stream,
+        on_partial=on_partial,
+    ))
 
 
-def generate_reflection_content_deepseek(
+async def generate_reflection_deepseek_async(
     api_key: str,
     club_name: str,
     title: str,
     club_desc: str = "",
     reflection_desc: str = "",
     model: str = "deepseek-chat",
-) -> str:
-    extra_context = ""
-    if club_desc:
-        extra_context += f"Club description: {club_desc}\n"
-    if reflection_desc:
-        extra_context += f"Reflection focus: {reflection_desc}\n"
-    user_content = (
-    f"Write an IB CAS Activity Reflection in English.\n"
-    f"Club: {club_name}\n"
-    f"Title: {title}\n\n"
-    f"{extra_context}"
-    f"Hard output rules (MUST follow):\n"
-    f"- Output ONLY the reflection body text.\n"
-    f"- Do NOT add a title, labels (e.g., 'Reflection:'), section headers, prefaces, explanations, or word counts.\n"
-    f"- No bullet points, no markdown, no quotes.\n\n"
-    f"Structure/length:\n"
-    f"- At least 550 words (target 600–750).\n"
-    f"- 4–7 paragraphs.\n\n"
-    f"Content requirements (anti-generic):\n"
-    f"- The first 70–85% must be specific and evidence-based: include at least 6–10 concrete details "
-    f"(exact tasks, decisions, what I said/did, what feedback I received, what I changed, specific examples).\n"
-    f"- If this is history-related (speech/lecture/presentation), include at least TWO concrete history takeaways "
-    f"(named event/person, date/time range, causation argument, key term, or historiographical insight) and explain how they shaped my thinking.\n"
-    f"- Only in the FINAL paragraph, allow brief general statements about growth/impact/next steps; avoid generic phrases elsewhere."
-    )
+    stream: bool = False,
+    on_partial=None,
+) -> tuple[str, str]:
+    return await _run_chat_steps_async(api_key, model, _reflection_steps(
+        club_name=club_name,
+        title=title,
+        club_desc=club_desc,
+        reflection_desc=reflection_desc,
+        stream=stream,
+        on_partial=on_partial,
+    ))
 
 
-    messages = [
-    {"role": "system", "content": "You write long-form IB CAS reflections. Output ONLY the final body text (no headings/labels/prefaces). Front-load concrete details and evidence; generic wrap-up only allowed in the last paragraph."},
-    {"role": "user", "content": user_content},
-    ]
+# -----------------------------
+# Generation pipeline
+# -----------------------------
 
+class GenerationPipeline:
+    """Runs DeepSeek generation ahead of the browser in its own thread/event loop.
+
+    Drafts are produced in item order with at most `prefetch` generated-but-not-yet-filled items
+    outstanding; the browser thread takes them in order with get(i), blocking only when the draft
+    it needs is not ready yet. `prepare` (optional) is awaited once and its result passed to
+    make_job(i, prepared) for every item."""
+
+    def __init__(self, count: int, make_job, prefetch: int = DEEPSEEK_PIPELINE_PREFETCH, prepare=None):
+        self.count = count
+        self.current = 0
+        self._make_job = make_job
+        self._prepare = prepare
+        self._prefetch = max(1, prefetch)
+        self.paused = False
+        self._cond = threading.Condition()
+        self._results = {}
+        self._failure = None
+        self._closed = False
+        self._loop = None
+        self._window = None
+        self._tasks = []
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            asyncio.run(self._produce())
+        except BaseException as e:
+            with self._cond:
+                self._failure = e
+                self._cond.notify_all()
+
+    async def _produce(self):
+        self._loop = asyncio.get_running_loop()
+        self._window = asyncio.Semaphore(self._prefetch)
+        prepared = await self._until_available(self._prepare) if self._prepare else None
+        for i in range(self.count):
+            await self._window.acquire()
+            if self._closed:
+                break
+            self._tasks.append(asyncio.create_task(self._job(i, prepared)))
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _job(self, i: int, prepared):
+        try:
+            outcome = (True, await self._until_available(lambda: self._make_job(i, prepared)))
+        except Exception as e:
+            outcome = (False, e)
+        with self._cond:
+            self._results[i] = outcome
+            self._cond.notify_all()
+
+    async def _until_available(self, make_coro):
+        """Await make_coro(); while DeepSeek's circuit is open, wait for the next probe and start it again
+        (for up to DEEPSEEK_BREAKER_MAX_PAUSE) instead of failing the item. The browser waits in get()."""
+        give_up = time.monotonic() + DEEPSEEK_BREAKER_MAX_PAUSE
+        while True:
+            try:
+                result = await make_coro()
+                self.paused = False
+                return result
+            except DeepSeekCircuitOpen as e:
+                if time.monotonic() + e.retry_in > give_up:
+                    raise
+                self.paused = True
+                await asyncio.sleep(e.retry_in)
+
+    def ready(self, i: int) -> bool:
+        with self._cond:
+            return i in self._results
+
+    def get(self, i: int):
+        with self._cond:
+            self.current = i
+            while i not in self._results:
+                if self._failure is not None:
+                    raise RuntimeError(f"Generation stage failed: {self._failure}") from self._failure
+                if self._closed:
+                    raise RunCancelled("run stopped by user.")
+                self._cond.wait(0.5)
+            ok, value = self._results.pop(i)
+        # Free one prefetch slot so the producer can start the next item.
+        self._call_in_loop(self._window.release)
+        if not ok:
+            raise value
+        return value
+
+    def close(self):
+        """Stop scheduling new items (the browser stage failed or the run was stopped) and wake get();
+        in-flight HTTP calls finish quietly."""
+        self._closed = True
+        self._call_in_loop(self._cancel_all)
+
+    def _call_in_loop(self, fn):
+        if self._loop is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(fn)
+        except RuntimeError:
+            pass  # producer already finished and its loop is closed
 
-    last = ""
-    for _ in range(3):
-        resp = deepseek_chat(api_key, model, messages, temperature=0.55, max_tokens=1400)
-        text = resp["choices"][0]["message"]["content"].strip()
-        last = text
-        if word_count(text) >= 550:
-            return text
-        messages.append({"role": "assistant", "content": text})
-        messages.append({"role": "user", "content": "Too short. Expand to 600–750 words. Keep it specific; no bullet points."})
+    def _cancel_all(self):
+        self._window.release()
+        for t in self._tasks:
+            t.cancel()
 
-    return last
+
+# -----------------------------
+# Browser session store
+# -----------------------------
+
+class SessionStore:
+    """Playwright storage_state per username, encrypted at rest with a key derived from username + password.
+
+    Stdlib only: PBKDF2-HMAC-SHA256 derives an encryption and a MAC key; the state is XORed with an
+    HMAC-SHA256 counter-mode keystream and authenticated with HMAC-SHA256 (encrypt-then-MAC).
+    A wrong password or a tampered file fails the MAC and reads as "no session".
+
+    Why not AES-GCM/Fernet: the app is installed with `pip install requests playwright` only (see README)
+    and Python ships no cipher, so a vetted AEAD would mean a new compiled dependency for every user.
+    The construction above uses nothing but stdlib HMAC/PBKDF2 in their standard roles (a PRF keystream
+    with a fresh random nonce per save, then a MAC over salt + nonce + ciphertext). Swap in
+    cryptography's AESGCM here if that package ever becomes a requirement; the file is versioned ("v")."""
+
+    ITERATIONS = 200_000
+
+    def __init__(self, folder: str):
+        self.folder = folder
+
+    def path(self, user: str) -> str:
+        name = hashlib.sha256(user.strip().lower().encode("utf-8")).hexdigest()[:24]
+        return os.path.join(self.folder, f"{name}.session")
+
+    def _keys(self, user: str, pw: str, salt: bytes) -> tuple[bytes, bytes]:
+        secret = f"{user.strip().lower()}\0{pw}".encode("utf-8")
+        key = hashlib.pbkdf2_hmac("sha256", secret, salt, self.ITERATIONS, dklen=64)
+        return key[:32], key[32:]
+
+    @staticmethod
+    def _keystream_xor(key: bytes, nonce: bytes, data: bytes) -> bytes:
+        out = bytearray()
+        for block in range(0, len(data), 32):
+            pad = hmac.new(key, nonce + (block // 32).to_bytes(8, "big"), hashlib.sha256).digest()
+            out.extend(b ^ k for b, k in zip(data[block:block + 32], pad))
+        return bytes(out)
+
+    def save(self, user: str, pw: str, state: dict):
+        salt, nonce = secrets.token_bytes(16), secrets.token_bytes(16)
+        enc_key, mac_key = self._keys(user, pw, salt)
+        ct = self._keystream_xor(enc_key, nonce, json.dumps(state).encode("utf-8"))
+        tag = hmac.new(mac_key, salt + nonce + ct, hashlib.sha256).digest()
+        blob = {k: base64.b64encode(v).decode("ascii") for k, v in
+                {"salt": salt, "nonce": nonce, "ct": ct, "tag": tag}.items()}
+        os.makedirs(self.folder, exist_ok=True)
+        tmp = self.path(user) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"v": 1, **blob}, f)
+        os.replace(tmp, self.path(user))
+
+    def load(self, user: str, pw: str):
+        try:
+            with open(self.path(user), encoding="utf-8") as f:
+                blob = json.load(f)
+            salt, nonce, ct, tag = (base64.b64decode(blob[k]) for k in ("salt", "nonce", "ct", "tag"))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        enc_key, mac_key = self._keys(user, pw, salt)
+        if not hmac.compare_digest(tag, hmac.new(mac_key, salt + nonce + ct, hashlib.sha256).digest()):
+            return None
+        try:
+            return json.loads(self._keystream_xor(enc_key, nonce, ct))
+        except ValueError:
+            return None
+
+    def clear(self, user: str):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path(user))
+
+
+SESSION_STORE = SessionStore(os.path.join(APP_DATA_DIR, "sessions"))
+
+
+# -----------------------------
+# Network filter
+# -----------------------------
+
+class StaticAssetCache:
+    """Site JS/CSS on disk across runs: one body file plus a small JSON meta file per URL.
+    Entries older than `ttl` seconds (or damaged ones) read as misses and are fetched again."""
+
+    def __init__(self, folder: str, ttl: float):
+        self.folder = folder
+        self.ttl = ttl
+
+    def _paths(self, url: str) -> tuple[str, str]:
+        name = hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.folder, f"{name}.body"), os.path.join(self.folder, f"{name}.json")
+
+    def get(self, url: str):
+        """(content_type, body) of a fresh entry, else None."""
+        body_path, meta_path = self._paths(url)
+        try:
+            if time.time() - os.path.getmtime(meta_path) > self.ttl:
+                return None
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        if meta.get("url") != url or meta.get("size") != len(body):
+            return None
+        return meta.get("content_type") or "application/octet-stream", body
+
+    def put(self, url: str, content_type: str, body: bytes):
+        body_path, meta_path = self._paths(url)
+        os.makedirs(self.folder, exist_ok=True)
+        with open(body_path + ".tmp", "wb") as f:
+            f.write(body)
+        os.replace(body_path + ".tmp", body_path)
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"url": url, "content_type": content_type, "size": len(body)}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+
+STATIC_ASSET_CACHE = StaticAssetCache(os.path.join(APP_DATA_DIR, "static_cache"), STATIC_CACHE_TTL)
+
+
+class NetworkFilter:
+    """Network layer for every context of one speed profile. With block_types or a cache it is a
+    page.route filter (allow/deny lists, then the static disk cache for JS/CSS); otherwise it only
+    watches responses, since routing would turn off the browser's own HTTP cache.
+
+    Counters are cumulative; take snapshot() before opening a dialog and pass it to report() once the
+    dialog is ready. Blocked requests never reach the network, so their size is the Content-Length last
+    seen for the same URL in an unrouted run (kept in sizes.json next to the cache)."""
+
+    def __init__(self, block_types: bool, cache: StaticAssetCache = None, log=None):
+        self._log = log or (lambda msg: None)
+        config = read_app_config().get("network") or {}
+        if not isinstance(config, dict):
+            self._log("[Network] config.json \"network\" must be an object; ignored")
+            config = {}
+        self.deny_types = NETWORK_DENY_TYPES if block_types else set()
+        self.deny = self._patterns(NETWORK_DENY_URLS, config.get("deny"), "deny")
+        self.allow = self._patterns(NETWORK_ALLOW_URLS, config.get("allow"), "allow")
+        self.cache = cache
+        self.routed = block_types or cache is not None
+        self.sizes_path = os.path.join(STATIC_ASSET_CACHE.folder, "sizes.json")
+        self.sizes = self._load_sizes()
+        self._sizes_dirty = False
+        self.totals = dict.fromkeys(
+            ("requests", "blocked", "blocked_bytes", "blocked_unknown", "cached", "cached_bytes"), 0
+        )
+
+    def _patterns(self, defaults: list, configured, key: str) -> list:
+        """Built-in regexes plus the config.json ones; a bad pattern is logged and skipped, not fatal."""
+        patterns = [re.compile(p) for p in defaults]
+        if configured is None:
+            return patterns
+        if not isinstance(configured, list):
+            self._log(f"[Network] config.json network.{key} must be a list; ignored")
+            return patterns
+        for p in configured:
+            try:
+                patterns.append(re.compile(p))
+            except (re.error, TypeError) as e:
+                self._log(f"[Network] config.json network.{key}: bad pattern {p!r} ignored ({e})")
+        return patterns
+
+    def install(self, context):
+        """Use as open_logged_in_page(prepare=...): route every request of the context through the filter
+        (only when it blocks or caches) and learn the sizes of heavy resources it lets through."""
+        if self.routed:
+            context.route("**/*", self._handle)
+        context.on("response", self._learn_size)
+
+    def _denied(self, url: str, kind: str) -> bool:
+        if any(p.search(url) for p in self.allow):
+            return False
+        return kind in self.deny_types or any(p.search(url) for p in self.deny)
+
+    def _handle(self, route):
+        request = route.request
+        url, kind = request.url, request.resource_type
+        self.totals["requests"] += 1
+        if self._denied(url, kind):
+            self.totals["blocked"] += 1
+            if url in self.sizes:
+                self.totals["blocked_bytes"] += self.sizes[url]
+            else:
+                self.totals["blocked_unknown"] += 1
+            route.abort("blockedbyclient")
+            return
+        if self.cache is None or kind not in STATIC_CACHE_TYPES or request.method != "GET":
+            route.continue_()
+            return
+
+        hit = self.cache.get(url)
+        if hit is not None:
+            content_type, body = hit
+            self.totals["cached"] += 1
+            self.totals["cached_bytes"] += len(body)
+            route.fulfill(status=200, content_type=content_type, body=body)
+            return
+        try:
+            response = route.fetch()
+            body = response.body()
+        except Exception:
+            route.continue_()  # let the browser load it (and report any failure) as usual
+            return
+        if response.status == 200 and "no-store" not in response.headers.get("cache-control", ""):
+            with contextlib.suppress(OSError):
+                self.cache.put(url, response.headers.get("content-type", ""), body)
+        route.fulfill(response=response, body=body)
+
+    def _learn_size(self, response):
+        if response.request.resource_type not in NETWORK_DENY_TYPES:
+            return
+        length = response.headers.get("content-length", "")
+        if length.isdigit() and self.sizes.get(response.url) != int(length):
+            self.sizes[response.url] = int(length)
+            self._sizes_dirty = True
+
+    def _load_sizes(self) -> dict:
+        try:
+            with open(self.sizes_path, encoding="utf-8") as f:
+                sizes = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return sizes if isinstance(sizes, dict) else {}
+
+    def save_sizes(self):
+        if not self._sizes_dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.sizes_path), exist_ok=True)
+            with open(self.sizes_path, "w", encoding="utf-8") as f:
+                json.dump(self.sizes, f)
+            self._sizes_dirty = False
+        except OSError:
+            pass
+
+    def snapshot(self) -> dict:
+        return dict(self.totals)
+
+    def report(self, since: dict) -> str:
+        d = {k: v - since.get(k, 0) for k, v in self.totals.items()}
+        saved = (d["blocked_bytes"] + d["cached_bytes"]) / 1024
+        line = (
+            f"{d['requests']} requests, {d['blocked']} blocked, {d['cached']} JS/CSS from disk; "
+            f"~{saved:.0f} KB saved"
+        )
+        if d["blocked_unknown"]:
+            line += f" (+{d['blocked_unknown']} blocked of unknown size)"
+        return line
 
 
 # -----------------------------
@@ -422,6 +2460,48 @@ def login_and_wait_home(page, user: str, pw: str):
     page.wait_for_selector("text=WFLA高中综合系统", timeout=20000)
 
 
+def session_is_valid(page, timeout_ms: int = 8000) -> bool:
+    """Cheap probe for a restored session: load the site once and see whether it shows home or the login form."""
+    page.goto(URL, wait_until="domcontentloaded")
+    home = page.get_by_text("WFLA高中综合系统")
+    login = page.locator("input[placeholder='Please enter your login account']")
+    try:
+        home.or_(login).first.wait_for(timeout=timeout_ms)
+    except PWTimeoutError:
+        return False
+    return home.first.is_visible()
+
+
+def open_logged_in_page(browser, user: str, pw: str, log=None, prepare=None):
+    """New page on the WFLA home screen: reuse the saved session when it is still valid,
+    otherwise log in and save the fresh session for the next run. prepare(context) runs on
+    every new context before its first navigation (e.g. NetworkFilter.install)."""
+    log = log or (lambda msg: None)
+    state = SESSION_STORE.load(user, pw)
+    if state is not None:
+        context = browser.new_context(storage_state=state)
+        if prepare:
+            prepare(context)
+        page = context.new_page()
+        if session_is_valid(page):
+            log("[Session] Reused saved login.")
+            return page
+        log("[Session] Saved login expired; logging in again.")
+        context.close()
+        SESSION_STORE.clear(user)
+
+    context = browser.new_context()
+    if prepare:
+        prepare(context)
+    page = context.new_page()
+    login_and_wait_home(page, user, pw)
+    try:
+        SESSION_STORE.save(user, pw, context.storage_state())
+    except OSError as e:
+        log(f"[Session] Could not save login: {e}")
+    return page
+
+
 def list_clubs_in_add_dialog(add_ctx):
     club_input = add_ctx.locator(
         "div.layui-form-item:has(label:has-text('Select a club')) "
@@ -456,10 +2536,10 @@ def open_records_list_ctx(page):
 def open_reflection_list_ctx(page):
     page.click("text=Club Info")
     page.click("text=Activity Reflection")
-    # The content is usually inside a dynamically-created iframe. Find it by src.
-    src = _find_iframe_src_contains(page, ["Stu/Cas", "Reflection"], timeout_ms=20000)
-    if src and "AddReflection" not in src:
-        return _frame_locator_by_src(page, src)
+    # The content is usually inside a dynamically-created iframe. Find its frame by URL.
+    frame = _find_frame_url_contains(page, ["Stu/Cas", "Reflection"], timeout_ms=20000, exclude="AddReflection")
+    if frame is not None:
+        return frame
 
     # Fallback patterns (best-effort)
     for css in ["iframe[src*='Stu/Cas/Reflection']", "iframe[src*='Stu/Cas/Reflec']"]:
@@ -500,6 +2580,18 @@ def open_add_reflection_ctx(reflection_list_ctx, page):
     return page.frame_locator(add_iframe_css)
 
 
+def dialog_load_ms(dialog_ctx):
+    """Navigation-timing load time of a dialog iframe in ms (None when it cannot be read)."""
+    try:
+        return dialog_ctx.locator("html").evaluate(
+            "() => { const n = performance.getEntriesByType('navigation')[0];"
+            " return n ? (n.loadEventEnd || performance.now()) - n.startTime : null; }",
+            timeout=2000,
+        )
+    except Exception:
+        return None
+
+
 def fill_kindeditor_body(add_ctx, text: str):
     """KindEditor uses an iframe for the editable body."""
     # Some pages may have multiple editor iframes; pick the first visible one.
@@ -530,6 +2622,133 @@ def click_learning_outcomes(add_ctx, selected: list[str]):
         time.sleep(0.05)
 
 
+# -----------------------------
+# Browser worker
+# -----------------------------
+
+class BrowserWorker:
+    """One long-lived automation thread that owns Playwright, the Chromium browser and a logged-in page.
+
+    Playwright's sync API must be used from the thread that started it, so GUI actions do not touch
+    the browser themselves: run(user, pw, job) queues job(page) on this thread and blocks for its result.
+    Between jobs the page is sent back to the home screen (which doubles as the session check); the
+    browser is launched on first use and relaunched if it was closed by hand. Every context goes
+    through one NetworkFilter per launch (`self.network`); it only routes for block_resources/static_cache."""
+
+    def __init__(self, log=None):
+        self._log = log or (lambda msg: None)
+        self._commands = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="browser-worker", daemon=True)
+        self._error = None  # set when Playwright itself failed; the worker thread is gone
+        self._error_lock = threading.Lock()
+        self._browser = None
+        self._profile = None
+        self.network = None
+        self._page = None
+        self._account = None
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def run(self, user: str, pw: str, job, profile: str = DEFAULT_SPEED_PROFILE, timer: StepTimer = None):
+        """Run job(page) on the worker thread with a page logged in as `user`, in the given speed profile
+        (the browser is relaunched when the profile changes). Re-raises job errors."""
+        future = concurrent.futures.Future()
+        with self._error_lock:
+            if self._error is not None:
+                raise RuntimeError(f"Browser worker is not running: {self._error}") from self._error
+            self._commands.put((user, pw, job, profile, timer or StepTimer(profile), future))
+        return future.result()
+
+    def stop(self, timeout: float = 10):
+        self._commands.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        try:
+            self._serve()
+        except BaseException as e:
+            # Playwright could not start (or died): fail everything queued and every later run() at once
+            # instead of leaving the GUI blocked on a future nobody will complete.
+            self._log(f"[Browser] Playwright stopped: {e}")
+            with self._error_lock:
+                self._error = e
+                while True:
+                    try:
+                        command = self._commands.get_nowait()
+                    except queue.Empty:
+                        break
+                    if command is not None:
+                        command[-1].set_exception(RuntimeError(f"Browser worker is not running: {e}"))
+
+    def _serve(self):
+        with sync_playwright() as p:
+            while True:
+                command = self._commands.get()
+                if command is None:
+                    break
+                user, pw, job, profile, timer, future = command
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    with timer.step("browser + session"):
+                        page = self._ready_page(p, user, pw, profile)
+                    future.set_result(job(page))
+                except BaseException as e:
+                    future.set_exception(e)
+                    self._drop_page()  # unknown dialog/iframe state; start the next job from a fresh page
+                if self.network is not None:
+                    self.network.save_sizes()
+            self._drop_page()
+            if self._browser is not None and self._browser.is_connected():
+                self._browser.close()
+
+    def _ready_page(self, p, user: str, pw: str, profile: str):
+        if self._browser is not None and self._browser.is_connected() and self._profile != profile:
+            self._log(f"[Browser] Switching to the {profile!r} speed profile; restarting Chromium.")
+            self._drop_page()
+            self._browser.close()
+        if self._browser is None or not self._browser.is_connected():
+            settings = SPEED_PROFILES[profile]
+            self._log(f"[Browser] Launching Chromium ({profile} profile)...")
+            self._browser = p.chromium.launch(headless=settings["headless"], slow_mo=settings["slow_mo"])
+            self._profile = profile
+            cache = STATIC_ASSET_CACHE if settings["static_cache"] else None
+            self.network = NetworkFilter(settings["block_resources"], cache, log=self._log)
+            self._page = None
+        if self._page is not None and not self._page.is_closed() and self._account == (user, pw):
+            if session_is_valid(self._page):
+                self._log("[Browser] Reusing the open browser session.")
+                return self._page
+            self._log("[Browser] Session expired; logging in again.")
+        self._drop_page()
+        prepare = self.network.install
+        self._page = open_logged_in_page(self._browser, user, pw, log=self._log, prepare=prepare)
+        self._account = (user, pw)
+        return self._page
+
+    def network_snapshot(self) -> dict:
+        """Network counters so far (empty before the first launch); take it just before opening a dialog."""
+        return self.network.snapshot() if self.network is not None else {}
+
+    def dialog_report(self, label: str, dialog_ctx, since: dict) -> str:
+        """Log line for one dialog: its iframe load time and, with the filter on, what was blocked or
+        served from disk since `since`. Call from inside a job, once the dialog is ready."""
+        ms = dialog_load_ms(dialog_ctx)
+        line = f"[Network] {label}: " + (f"loaded in {ms / 1000:.2f}s" if ms is not None else "load time unavailable")
+        if self.network is not None and self.network.routed:
+            line += "; " + self.network.report(since)
+        return line
+
+    def _drop_page(self):
+        if self._page is not None:
+            with contextlib.suppress(Exception):
+                self._page.context.close()
+        self._page = None
+        self._account = None
+
+
 # -----------------------------
 # GUI App
 # -----------------------------
@@ -757,10 +2976,17 @@ class V42App(tk.Tk):
 
         self.log_q = queue.Queue()
         self.worker = None
+        self.run_timer = None
+        self.browser = BrowserWorker(log=self._log).start()
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+        self._last_partial_preview = 0.0
 
         self.clubs_records: list[str] = []
         self.clubs_reflection: list[str] = []
 
+        set_deepseek_logger(self._log)
+        DEEPSEEK_BREAKER.on_change = self._set_deepseek_status
+
         self._build_style()
         self._build_ui()
         self.after(100, self._poll_logs)
@@ -926,6 +3152,26 @@ class V42App(tk.Tk):
             darkcolor=[("focus", colors["accent"])],
         )
 
+    def _checkbox(self, parent, text, variable):
+        return tk.Checkbutton(
+            parent,
+            text=text,
+            variable=variable,
+            image=self.cb_img_off,
+            selectimage=self.cb_img_on,
+            indicatoron=0,          # remove default indicator
+            compound="left",        # image on the left, text on the right
+            padx=6,
+            anchor="w",
+            background=self.colors["surface"],
+            activebackground=self.colors["surface"],
+            foreground=self.colors["text"],
+            selectcolor=self.colors["surface"],
+            highlightthickness=0,
+            bd=0,
+            font=("Segoe UI", 10),
+        )
+
     def _row(self, parent, r, label, widget_builder):
         row = ttk.Frame(parent, style="Surface.TFrame")
         row.grid(row=r, column=0, sticky="ew", pady=4)
@@ -976,8 +3222,24 @@ class V42App(tk.Tk):
         self._row(lf_acc, 0, "Username", lambda p: ttk.Entry(p, textvariable=self.var_user, width=34))
         self._row(lf_acc, 1, "Password", lambda p: ttk.Entry(p, textvariable=self.var_pass, show="•", width=34))
         self._row(lf_acc, 2, "DeepSeek API Key", lambda p: ttk.Entry(p, textvariable=self.var_dskey, show="•", width=34))
+        self.var_bypass_cache = tk.BooleanVar(value=False)
+        # custom checkbox icons (avoid missing-glyph boxes on some systems)
+        self.cb_img_off, self.cb_img_on = self._make_checkbox_images()
+        self._row(
+            lf_acc, 3, "DeepSeek cache",
+            lambda p: self._checkbox(p, "Bypass cache (always regenerate)", self.var_bypass_cache)
+        )
+        profile = read_app_config().get("speed_profile", DEFAULT_SPEED_PROFILE)
+        self.var_speed_profile = tk.StringVar(value=profile if profile in SPEED_PROFILES else DEFAULT_SPEED_PROFILE)
+        self.combo_speed_profile = self._row(
+            lf_acc, 4, "Browser speed",
+            lambda p: ttk.Combobox(
+                p, textvariable=self.var_speed_profile, width=31, state="readonly", values=list(SPEED_PROFILES)
+            )
+        )
+        self.combo_speed_profile.bind("<<ComboboxSelected>>", self._on_speed_profile_selected)
         self.btn_fetch_clubs = self._row(
-            lf_acc, 3, "",
+            lf_acc, 5, "",
             lambda p: ttk.Button(p, text="Fetch clubs", style="Fetch.TButton", width=12, command=self.on_fetch_clubs_records)
         )
 
@@ -1157,31 +3419,11 @@ class V42App(tk.Tk):
 
         grid = ttk.Frame(outcomes_box, style="Surface.TFrame")
         grid.pack(fill="x")
-        # custom checkbox icons (avoid missing-glyph boxes on some systems)
-        self.cb_img_off, self.cb_img_on = self._make_checkbox_images()
-
         # 2 rows x 4 columns
         for idx, name in enumerate(self.OUTCOMES):
             r = idx // 4
             c = idx % 4
-            cb = tk.Checkbutton(
-                grid,
-                text=name,
-                variable=self.outcome_vars[name],
-                image=self.cb_img_off,
-                selectimage=self.cb_img_on,
-                indicatoron=0,          # remove default indicator
-                compound="left",        # image on the left, text on the right
-                padx=6,
-                anchor="w",
-                background=self.colors["surface"],
-                activebackground=self.colors["surface"],
-                foreground=self.colors["text"],
-                selectcolor=self.colors["surface"],
-                highlightthickness=0,
-                bd=0,
-                font=("Segoe UI", 10),
-            )
+            cb = self._checkbox(grid, name, self.outcome_vars[name])
             cb.grid(row=r, column=c, sticky="w", padx=8, pady=4)
 
 
@@ -1227,25 +3469,39 @@ class V42App(tk.Tk):
 
         footer = ttk.Frame(root, style="App.TFrame")
         footer.pack(fill="x", pady=(10, 0))
-        self.btn_stop = ttk.Button(footer, text="Close browser (manual)", command=self.on_hint_stop)
+        self.btn_stop = ttk.Button(footer, text="Stop run", command=self.on_stop_run, state="disabled")
         self.btn_stop.pack(side="left")
         ttk.Label(
             footer,
             text="V5.0.0 - Records + Reflection + Weekly Batch (DeepSeek)",
             style="Footer.TLabel",
         ).pack(side="left", padx=(12, 0))
+        self.lbl_deepseek_status = ttk.Label(footer, text="DeepSeek: ready", style="Footer.TLabel")
+        self.lbl_deepseek_status.pack(side="right")
 
     # ---------- logging / previews ----------
 
     def _log(self, msg: str):
         self.log_q.put(msg)
 
+    def _set_deepseek_status(self, state: str):
+        # Called from DEEPSEEK_BREAKER on whichever thread made the call.
+        self.log_q.put(("__DEEPSEEK_STATUS__", state))
+
     def _set_preview_record(self, text: str):
         self.log_q.put(("__PREVIEW_REC__", text))
 
     def _set_preview_reflection(self, summary: str, content: str):
         self.log_q.put(("__PREVIEW_REF__", summary, content))
 
+    def _set_preview_reflection_partial(self, content: str):
+        # Called per streamed chunk from the worker thread; throttle so Tk is not flooded.
+        now = time.monotonic()
+        if now - self._last_partial_preview < 0.2:
+            return
+        self._last_partial_preview = now
+        self.log_q.put(("__PREVIEW_REF_PARTIAL__", content))
+
     def _poll_logs(self):
         try:
             while True:
@@ -1266,6 +3522,18 @@ class V42App(tk.Tk):
                     self.txt_preview_reflection.delete("1.0", "end")
                     self.txt_preview_reflection.insert("end", content)
                     self.txt_preview_reflection.configure(state="disabled")
+                elif isinstance(item, tuple) and item and item[0] == "__DEEPSEEK_STATUS__":
+                    text, color = {
+                        "open": ("DeepSeek: unavailable, paused", UI_COLORS["danger"]),
+                        "half_open": ("DeepSeek: probing...", UI_COLORS["accent"]),
+                    }.get(item[1], ("DeepSeek: ready", UI_COLORS["muted"]))
+                    self.lbl_deepseek_status.configure(text=text, foreground=color)
+                elif isinstance(item, tuple) and item and item[0] == "__PREVIEW_REF_PARTIAL__":
+                    self.txt_preview_reflection.configure(state="normal")
+                    self.txt_preview_reflection.delete("1.0", "end")
+                    self.txt_preview_reflection.insert("end", item[1])
+                    self.txt_preview_reflection.see("end")
+                    self.txt_preview_reflection.configure(state="disabled")
                 else:
                     self.txt_log.configure(state="normal")
                     self.txt_log.insert("end", str(item) + "\n")
@@ -1376,10 +3644,60 @@ class V42App(tk.Tk):
             raise ValueError("Select at least one Learning Outcome.")
         return club, club_desc, desc_lines, titles, selected
 
+    def _begin_deepseek_run(self):
+        routes = DEEPSEEK_ROUTER.load()
+        for task, route in sorted(routes.items()):
+            self._log(f"[DeepSeek] Route {task}: " + ", ".join(f"{k}={v}" for k, v in sorted(route.items())))
+        DEEPSEEK_CACHE.bypass = self.var_bypass_cache.get()
+        DEEPSEEK_CACHE.reset_counters()
+        DEEPSEEK_RUN_STATS.reset()
+
+    def _end_deepseek_run(self, tag: str):
+        try:
+            DEEPSEEK_TOKEN_BUDGETS.save()
+        except OSError as e:
+            self._log(f"[{tag}] Could not save token calibration: {e}")
+        bypass = " (bypassed)" if DEEPSEEK_CACHE.bypass else ""
+        self._log(f"[{tag}] DeepSeek cache{bypass}: {DEEPSEEK_CACHE.hits} hits, {DEEPSEEK_CACHE.misses} misses.")
+        stats = DEEPSEEK_RUN_STATS
+        report = stats.report(tag)
+        if not report["calls"]:
+            return
+        self._log(
+            f"[{tag}] DeepSeek prompt cache: {stats.prompt_cache_hit_tokens} hit / "
+            f"{stats.prompt_cache_miss_tokens} miss tokens ({stats.prompt_cache_ratio():.0%} hit ratio)."
+        )
+        for label, rows in [("total", {"all": report["totals"]}), ("generator", report["by_generator"]),
+                            ("item", report["by_item"])]:
+            for name, t in rows.items():
+                self._log(
+                    f"[{tag}] Usage by {label} {name}: {t['calls']} calls, "
+                    f"{t['prompt_tokens']}+{t['completion_tokens']} tokens, {t['seconds']:.1f}s, "
+                    f"{t['retries']} retries, {t['truncated']} truncated"
+                )
+        for route, t in report["by_route"].items():
+            lat = t["latency"]
+            self._log(
+                f"[{tag}] Latency by route {route}: mean {lat['mean']:.1f}s, p50 {lat['p50']:.1f}s, "
+                f"p95 {lat['p95']:.1f}s over {t['calls'] - t['cached']} API calls"
+            )
+        expansion = report["expansion"]
+        if expansion["requests"]:
+            self._log(
+                f"[{tag}] Expansion retries: {expansion['requests']} sent ~{expansion['sent_tokens']} tokens "
+                f"instead of ~{expansion['full_resend_tokens']} (saved ~{expansion['saved_tokens']})."
+            )
+        try:
+            path = stats.write_report(tag)
+            self._log(f"[{tag}] Run report written to {path}")
+        except OSError as e:
+            self._log(f"[{tag}] Could not write run report: {e}")
+
     def _set_buttons_running(self, running: bool):
         state = "disabled" if running else "normal"
         for b in [self.btn_fetch_clubs, self.btn_rec_run, self.btn_batch_run, self.btn_ref_run]:
             b.configure(state=state)
+        self.btn_stop.configure(state="normal" if running else "disabled")
 
     def _open_rec_date_picker(self):
         raw = self.var_rec_date.get().strip()
@@ -1455,12 +3773,25 @@ class V42App(tk.Tk):
 
     # ---------- actions ----------
 
-    def on_hint_stop(self):
-        messagebox.showinfo(
-            "Note",
-            "The browser is controlled by Playwright during a run.\n"
-            "To interrupt: close the Playwright browser window manually; the run will fail and return to the app."
-        )
+    def _on_speed_profile_selected(self, _event=None):
+        profile = self.var_speed_profile.get()
+        try:
+            update_app_config(speed_profile=profile)
+        except OSError as e:
+            self._log(f"[Browser] Could not save speed profile: {e}")
+        self._log(f"[Browser] Speed profile: {profile}")
+
+    def _on_close(self):
+        self.browser.stop(timeout=5)
+        self.destroy()
+
+    def on_stop_run(self):
+        # Works in every speed profile, including the headless ones where there is no window to close.
+        if self.run_timer is None or not (self.worker and self.worker.is_alive()):
+            return
+        self._log("[Run] Stopping after the current browser step...")
+        self.btn_stop.configure(state="disabled")
+        self.run_timer.cancel()
 
     def on_fetch_clubs_records(self):
         if self.worker and self.worker.is_alive():
@@ -1472,19 +3803,21 @@ class V42App(tk.Tk):
             return
 
         self._set_buttons_running(True)
+        profile = self.var_speed_profile.get()
+        timer = self.run_timer = StepTimer(profile)
         self._log("[Clubs] Fetch clubs: logging in and opening Add Record...")
 
         def task():
             try:
-                with sync_playwright() as p:
-                    browser = p.chromium.launch(headless=False, slow_mo=60)
-                    page = browser.new_page()
-
-                    login_and_wait_home(page, user, pw)
-                    record_list_ctx = open_records_list_ctx(page)
-                    add_ctx = open_add_record_ctx(record_list_ctx, page)
+                def fill(page):
+                    with timer.step("open dialog"):
+                        record_list_ctx = open_records_list_ctx(page)
+                        since = self.browser.network_snapshot()
+                        add_ctx = open_add_record_ctx(record_list_ctx, page)
 
-                    clubs = list_clubs_in_add_dialog(add_ctx)
+                    with timer.step("list clubs"):
+                        clubs = list_clubs_in_add_dialog(add_ctx)
+                    self._log(self.browser.dialog_report("Add Record dialog", add_ctx, since))
                     if not clubs:
                         raise RuntimeError("No clubs found in dropdown (Records).")
 
@@ -1496,7 +3829,8 @@ class V42App(tk.Tk):
                         f"[Clubs] Fetched {len(self.clubs_records)} clubs for records, "
                         f"{len(self.clubs_reflection)} for reflection."
                     )
-                    browser.close()
+
+                self.browser.run(user, pw, fill, profile, timer)
 
                 def update_ui():
                     self.combo_rec_club.configure(values=self.clubs_records)
@@ -1513,9 +3847,14 @@ class V42App(tk.Tk):
 
                 self.after(0, update_ui)
 
+            except RunCancelled:
+                self._log("[Clubs] Fetch clubs stopped.")
+                self.after(0, lambda: self._set_buttons_running(False))
             except Exception as e:
                 self._log(f"[Clubs] ❌ Fetch clubs failed: {e}")
                 self.after(0, lambda: self._set_buttons_running(False))
+            finally:
+                self._log(timer.summary())
 
         self.worker = threading.Thread(target=task, daemon=True)
         self.worker.start()
@@ -1535,71 +3874,86 @@ class V42App(tk.Tk):
             return
 
         self._set_buttons_running(True)
+        profile = self.var_speed_profile.get()
+        timer = self.run_timer = StepTimer(profile)
         self._log("[Records] Run started: generating description + autofilling...")
+        self._begin_deepseek_run()
 
         def task():
             try:
-                with sync_playwright() as p:
-                    browser = p.chromium.launch(headless=False, slow_mo=60)
-                    page = browser.new_page()
-
-                    login_and_wait_home(page, user, pw)
-                    record_list_ctx = open_records_list_ctx(page)
-                    add_ctx = open_add_record_ctx(record_list_ctx, page)
+                def fill(page):
+                    with timer.step("open dialog"):
+                        record_list_ctx = open_records_list_ctx(page)
+                        since = self.browser.network_snapshot()
+                        add_ctx = open_add_record_ctx(record_list_ctx, page)
 
-                    self._log(f"[Records] Selecting club: {club}")
-                    select_club_by_text(add_ctx, club)
+                        self._log(f"[Records] Selecting club: {club}")
+                        select_club_by_text(add_ctx, club)
+                    self._log(self.browser.dialog_report("Add Record dialog", add_ctx, since))
 
                     self._log("[Records] Calling DeepSeek to generate record description...")
-                    desc = generate_activity_record_deepseek(
-                        api_key=key,
-                        club_name=club,
-                        date_ymd=date_ymd,
-                        theme=theme,
-                        c_hours=c,
-                        a_hours=a,
-                        s_hours=s,
-                        model="deepseek-chat",
-                    )
+                    with deepseek_item(date_ymd), timer.step("generate"):
+                        desc = generate_activity_record_deepseek(
+                            api_key=key,
+                            club_name=club,
+                            date_ymd=date_ymd,
+                            theme=theme,
+                            c_hours=c,
+                            a_hours=a,
+                            s_hours=s,
+                            model="deepseek-chat",
+                        )
                     self._set_preview_record(desc)
                     self._log("[Records] DeepSeek description generated.")
 
-                    # Date
-                    date_input = add_ctx.locator(
-                        "div.layui-form-item:has(label:has-text('Event date')) input"
-                    )
-                    date_input.click()
-                    cal_scope = add_ctx if add_ctx.locator("#layui-laydate1").count() else page
-                    select_date_layui(cal_scope, y, mo, d)
-                    self._log(f"[Records] Date selected: {date_ymd}")
+                    with timer.step("fill form"):
+                        # Date
+                        date_input = add_ctx.locator(
+                            "div.layui-form-item:has(label:has-text('Event date')) input"
+                        )
+                        date_input.click()
+                        cal_scope = add_ctx if add_ctx.locator("#layui-laydate1").count() else page
+                        select_date_layui(cal_scope, y, mo, d)
+                        self._log(f"[Records] Date selected: {date_ymd}")
+
+                        # Theme + hours + description
+                        add_ctx.locator(
+                            "div.layui-form-item:has(label:has-text('Activity theme')) input"
+                        ).fill(theme)
 
-                    # Theme + hours + description
-                    add_ctx.locator(
-                        "div.layui-form-item:has(label:has-text('Activity theme')) input"
-                    ).fill(theme)
+                        add_ctx.locator("input[name='CDuration']").fill(c)
+                        add_ctx.locator("input[name='ADuration']").fill(a)
+                        add_ctx.locator("input[name='SDuration']").fill(s)
 
-                    add_ctx.locator("input[name='CDuration']").fill(c)
-                    add_ctx.locator("input[name='ADuration']").fill(a)
-                    add_ctx.locator("input[name='SDuration']").fill(s)
+                        # Activity description textarea is named Reflection in Record form
+                        add_ctx.locator("textarea[name='Reflection']").fill(desc)
 
-                    # Activity description textarea is named Reflection in Record form
-                    add_ctx.locator("textarea[name='Reflection']").fill(desc)
+                    with timer.step("save"):
+                        add_ctx.locator("button[lay-filter='add']:has-text('Save')").click()
+                        self._log("[Records] ✅ Save clicked.")
 
-                    add_ctx.locator("button[lay-filter='add']:has-text('Save')").click()
-                    self._log("[Records] ✅ Save clicked.")
+                        try:
+                            page.locator("iframe[src*='/Stu/Cas/AddRecord']").wait_for(state="detached", timeout=10000)
+                        except Exception:
+                            time.sleep(1.2)
 
-                    time.sleep(2)
-                    browser.close()
+                self.browser.run(user, pw, fill, profile, timer)
 
                 self._log("[Records] ✅ Run finished.")
                 self.after(0, lambda: self._set_buttons_running(False))
 
+            except RunCancelled:
+                self._log("[Records] Run stopped.")
+                self.after(0, lambda: self._set_buttons_running(False))
             except PWTimeoutError as e:
                 self._log(f"[Records] ❌ Timeout: {e}")
                 self.after(0, lambda: self._set_buttons_running(False))
             except Exception as e:
                 self._log(f"[Records] ❌ Error: {e}")
                 self.after(0, lambda: self._set_buttons_running(False))
+            finally:
+                self._log(timer.summary())
+                self._end_deepseek_run("Records")
 
         self.worker = threading.Thread(target=task, daemon=True)
         self.worker.start()
@@ -1615,77 +3969,96 @@ class V42App(tk.Tk):
             return
 
         self._set_buttons_running(True)
+        profile = self.var_speed_profile.get()
+        timer = self.run_timer = StepTimer(profile)
         self._log(f"[Batch] Run started: {len(dates)} weekly records.")
+        self._begin_deepseek_run()
 
         def task():
-            used_themes: list[str] = []
-            used_descs: list[str] = []
+            total = len(dates)
+            date_labels = [f"{d.year:04d}/{d.month:02d}/{d.day:02d}" for d in dates]
+
+            async def plan():
+                self._log(f"[Batch] Planning {total} weekly themes in one call...")
+                with deepseek_item("plan"):
+                    themes = await generate_weekly_plan_deepseek_async(
+                        key, club, club_desc, periodic, date_labels, "deepseek-chat"
+                    )
+                self._log("[Batch] Themes planned; generating descriptions ahead of the browser.")
+                return WeeklyDraftPlan(themes)
+
+            # Generation starts right away and runs ahead of login and form filling.
+            pipeline = GenerationPipeline(
+                total,
+                lambda i, drafts: generate_weekly_draft_deepseek_async(
+                    key, club, club_desc, periodic, date_labels, drafts, i, "deepseek-chat"
+                ),
+                prepare=plan,
+            ).start()
+            timer.on_cancel(pipeline.close)
             try:
-                with sync_playwright() as p:
-                    browser = p.chromium.launch(headless=False, slow_mo=60)
-                    page = browser.new_page()
-
-                    login_and_wait_home(page, user, pw)
+                def fill(page):
                     record_list_ctx = open_records_list_ctx(page)
 
-                    total = len(dates)
-                    for idx, dt_item in enumerate(dates, start=1):
-                        date_ymd = f"{dt_item.year:04d}/{dt_item.month:02d}/{dt_item.day:02d}"
-                        self._log(f"[Batch] ({idx}/{total}) Generating theme + description for {date_ymd}...")
-                        theme, desc = generate_weekly_theme_desc_deepseek(
-                            api_key=key,
-                            club_name=club,
-                            date_ymd=date_ymd,
-                            club_desc=club_desc,
-                            periodic_desc=periodic,
-                            used_themes=used_themes,
-                            used_descs=used_descs,
-                            model="deepseek-chat",
-                        )
+                    for idx, (dt_item, date_ymd) in enumerate(zip(dates, date_labels), start=1):
+                        if not pipeline.ready(idx - 1):
+                            self._log(f"[Batch] ({idx}/{total}) Waiting for DeepSeek draft...")
+                            if pipeline.paused:
+                                self._log("[Batch] DeepSeek is unavailable; browser paused until it recovers.")
+                        with timer.step("wait for draft"):
+                            theme, desc = pipeline.get(idx - 1)
                         if not theme or not desc:
                             raise RuntimeError(f"DeepSeek returned empty content for {date_ymd}.")
 
-                        used_themes.append(theme)
-                        used_descs.append(desc)
                         self._set_preview_record(f"{theme}\n\n{desc}")
                         self._log(f"[Batch] ({idx}/{total}) Filling record for {date_ymd}...")
 
-                        add_ctx = open_add_record_ctx(record_list_ctx, page)
-                        select_club_by_text(add_ctx, club)
+                        with timer.step("open dialog"):
+                            since = self.browser.network_snapshot()
+                            add_ctx = open_add_record_ctx(record_list_ctx, page)
+                            select_club_by_text(add_ctx, club)
+                        self._log(self.browser.dialog_report(f"({idx}/{total}) Add Record dialog", add_ctx, since))
 
-                        date_input = add_ctx.locator(
-                            "div.layui-form-item:has(label:has-text('Event date')) input"
-                        )
-                        date_input.click()
-                        cal_scope = add_ctx if add_ctx.locator("#layui-laydate1").count() else page
-                        select_date_layui(cal_scope, dt_item.year, dt_item.month, dt_item.day)
+                        with timer.step("fill form"):
+                            date_input = add_ctx.locator(
+                                "div.layui-form-item:has(label:has-text('Event date')) input"
+                            )
+                            date_input.click()
+                            cal_scope = add_ctx if add_ctx.locator("#layui-laydate1").count() else page
+                            select_date_layui(cal_scope, dt_item.year, dt_item.month, dt_item.day)
 
-                        add_ctx.locator(
-                            "div.layui-form-item:has(label:has-text('Activity theme')) input"
-                        ).fill(theme)
+                            add_ctx.locator(
+                                "div.layui-form-item:has(label:has-text('Activity theme')) input"
+                            ).fill(theme)
 
-                        add_ctx.locator("input[name='CDuration']").fill(c)
-                        add_ctx.locator("input[name='ADuration']").fill(a)
-                        add_ctx.locator("input[name='SDuration']").fill(s)
+                            add_ctx.locator("input[name='CDuration']").fill(c)
+                            add_ctx.locator("input[name='ADuration']").fill(a)
+                            add_ctx.locator("input[name='SDuration']").fill(s)
 
-                        add_ctx.locator("textarea[name='Reflection']").fill(desc)
+                            add_ctx.locator("textarea[name='Reflection']").fill(desc)
 
-                        add_ctx.locator("button[lay-filter='add']:has-text('Save')").click()
-                        self._log(f"[Batch] ({idx}/{total}) Save clicked.")
+                        with timer.step("save"):
+                            add_ctx.locator("button[lay-filter='add']:has-text('Save')").click()
+                            self._log(f"[Batch] ({idx}/{total}) Save clicked.")
 
-                        try:
-                            page.locator("iframe[src*='/Stu/Cas/AddRecord']").wait_for(state="detached", timeout=10000)
-                        except Exception:
-                            time.sleep(1.2)
+                            try:
+                                page.locator("iframe[src*='/Stu/Cas/AddRecord']").wait_for(state="detached", timeout=10000)
+                            except Exception:
+                                time.sleep(1.2)
 
-                    browser.close()
+                self.browser.run(user, pw, fill, profile, timer)
 
                 self._log("[Batch] Run finished.")
+            except RunCancelled:
+                self._log("[Batch] Run stopped.")
             except PWTimeoutError as e:
                 self._log(f"[Batch] Timeout: {e}")
             except Exception as e:
                 self._log(f"[Batch] Error: {e}")
             finally:
+                pipeline.close()
+                self._log(timer.summary())
+                self._end_deepseek_run("Batch")
                 self.after(0, lambda: self._set_buttons_running(False))
 
         self.worker = threading.Thread(target=task, daemon=True)
@@ -1702,83 +4075,101 @@ class V42App(tk.Tk):
             return
 
         self._set_buttons_running(True)
+        profile = self.var_speed_profile.get()
+        timer = self.run_timer = StepTimer(profile)
         self._log(f"[Reflection] Run started: {len(titles)} reflections.")
+        self._begin_deepseek_run()
 
         def task():
+            total = len(titles)
+
+            def make_job(i, _prepared):
+                def on_partial(text, i=i):
+                    # Only the draft the browser is waiting for is streamed into the preview.
+                    if pipeline.current == i:
+                        self._set_preview_reflection_partial(text)
+
+                async def job():
+                    with deepseek_item(titles[i]):
+                        return await generate_reflection_deepseek_async(
+                            key, club, titles[i], club_desc, desc_lines[i], "deepseek-chat",
+                            stream=True, on_partial=on_partial,
+                        )
+                return job()
+
+            # Generation starts right away and runs ahead of login and form filling.
+            self._log("[Reflection] Generating summaries + reflections ahead of the browser...")
+            # Bind `pipeline` before starting it: on a cache hit on_partial runs in the producer right away.
+            pipeline = GenerationPipeline(total, make_job)
+            pipeline.start()
+            timer.on_cancel(pipeline.close)
             try:
-                with sync_playwright() as p:
-                    browser = p.chromium.launch(headless=False, slow_mo=60)
-                    page = browser.new_page()
-
-                    login_and_wait_home(page, user, pw)
+                def fill(page):
                     refl_list_ctx = open_reflection_list_ctx(page)
 
-                    total = len(titles)
                     for idx, title in enumerate(titles, start=1):
-                        reflection_desc = desc_lines[idx - 1]
-                        self._log(f"[Reflection] ({idx}/{total}) Opening add dialog...")
-                        add_ctx = open_add_reflection_ctx(refl_list_ctx, page)
-
-                        self._log(f"[Reflection] ({idx}/{total}) Selecting club: {club}")
-                        select_club_by_text(add_ctx, club)
+                        if not pipeline.ready(idx - 1):
+                            self._log(f"[Reflection] ({idx}/{total}) Waiting for DeepSeek draft...")
+                            if pipeline.paused:
+                                self._log("[Reflection] DeepSeek is unavailable; browser paused until it recovers.")
+                        with timer.step("wait for draft"):
+                            summary, reflection_text = pipeline.get(idx - 1)
+                        self._log(f"[Reflection] ({idx}/{total}) Draft ready.")
 
-                        # Title
-                        add_ctx.locator("input[name='Title']").fill(title)
-
-                        # DeepSeek generation
-                        self._log(f"[Reflection] ({idx}/{total}) Generating 20-word summary...")
-                        summary = generate_reflection_summary_deepseek(
-                            api_key=key,
-                            club_name=club,
-                            title=title,
-                            club_desc=club_desc,
-                            reflection_desc=reflection_desc,
-                            model="deepseek-chat",
+                        self._log(f"[Reflection] ({idx}/{total}) Opening add dialog...")
+                        with timer.step("open dialog"):
+                            since = self.browser.network_snapshot()
+                            add_ctx = open_add_reflection_ctx(refl_list_ctx, page)
+
+                            self._log(f"[Reflection] ({idx}/{total}) Selecting club: {club}")
+                            select_club_by_text(add_ctx, club)
+                        self._log(
+                            self.browser.dialog_report(f"({idx}/{total}) Add Reflection dialog", add_ctx, since)
                         )
-                        self._log(f"[Reflection] ({idx}/{total}) Summary generated.")
 
-                        self._log(f"[Reflection] ({idx}/{total}) Generating reflection content...")
-                        reflection_text = generate_reflection_content_deepseek(
-                            api_key=key,
-                            club_name=club,
-                            title=title,
-                            club_desc=club_desc,
-                            reflection_desc=reflection_desc,
-                            model="deepseek-chat",
-                        )
-                        self._log(f"[Reflection] ({idx}/{total}) Reflection generated.")
-                        self._set_preview_reflection(summary, reflection_text)
+                        with timer.step("fill form"):
+                            # Title
+                            add_ctx.locator("input[name='Title']").fill(title)
 
-                        # Fill Content Summary
-                        add_ctx.locator("textarea[name='Summary']").fill(summary)
+                            self._set_preview_reflection(summary, reflection_text)
 
-                        # Fill Reflection content (KindEditor)
-                        fill_kindeditor_body(add_ctx, reflection_text)
+                            # Fill Content Summary
+                            add_ctx.locator("textarea[name='Summary']").fill(summary)
 
-                        # Click Learning Outcomes
-                        self._log(f"[Reflection] ({idx}/{total}) Selecting Learning Outcome: {', '.join(selected)}")
-                        click_learning_outcomes(add_ctx, selected)
+                            # Fill Reflection content (KindEditor)
+                            fill_kindeditor_body(add_ctx, reflection_text)
 
-                        # Save
-                        add_ctx.locator("button[lay-filter='add']:has-text('Save')").click()
-                        self._log(f"[Reflection] ({idx}/{total}) Save clicked.")
+                            # Click Learning Outcomes
+                            self._log(f"[Reflection] ({idx}/{total}) Selecting Learning Outcome: {', '.join(selected)}")
+                            click_learning_outcomes(add_ctx, selected)
 
-                        try:
-                            page.locator("iframe[src*='/Stu/Cas/AddReflection']").wait_for(state="detached", timeout=12000)
-                        except Exception:
-                            time.sleep(1.2)
+                        with timer.step("save"):
+                            add_ctx.locator("button[lay-filter='add']:has-text('Save')").click()
+                            self._log(f"[Reflection] ({idx}/{total}) Save clicked.")
+
+                            try:
+                                page.locator("iframe[src*='/Stu/Cas/AddReflection']").wait_for(state="detached", timeout=12000)
+                            except Exception:
+                                time.sleep(1.2)
 
-                    browser.close()
+                self.browser.run(user, pw, fill, profile, timer)
 
                 self._log("[Reflection] Run finished.")
                 self.after(0, lambda: self._set_buttons_running(False))
 
+            except RunCancelled:
+                self._log("[Reflection] Run stopped.")
+                self.after(0, lambda: self._set_buttons_running(False))
             except PWTimeoutError as e:
                 self._log(f"[Reflection] Timeout: {e}")
                 self.after(0, lambda: self._set_buttons_running(False))
             except Exception as e:
                 self._log(f"[Reflection] Error: {e}")
                 self.after(0, lambda: self._set_buttons_running(False))
+            finally:
+                pipeline.close()
+                self._log(timer.summary())
+                self._end_deepseek_run("Reflection")
 
         self.worker = threading.Thread(target=task, daemon=True)
         self.worker.start()